@@ -19,13 +19,17 @@ class Loopover:
         self.parse_positions()
 
         self.moves_made = []
+        self.moves_saved = 0
 
     def solve(self):
         for y in range(self.height - 1):
             for x in range(self.width):
                 self.solve_position((x, y))
         self.solve_final()
-        return self.moves_made if self.grid == self.end else None
+        if self.grid != self.end:
+            return None
+        self.compress_moves()
+        return self.moves_made
 
     def solve_position(self, correct_pos):
         current_num = self.correct_num_at[correct_pos]
@@ -115,6 +119,39 @@ class Loopover:
 
         self.moves_made.extend([move_made] * abs(times))
 
+    def compress_moves(self):
+        """Shortens `self.moves_made` without changing the result, setting `self.moves_saved`
+        to the amount of moves removed. Moves of rows can be done in any order between
+        moves of columns (and the other way around), so each run of them is merged into
+        the net rotation of each line, made in the shortest direction, so R0 R0 R0 R0 on
+        a 5 wide grid becomes L0. When a run cancels out entirely, the runs on either side
+        of it are merged, so R0 D1 U1 L0 becomes nothing."""
+        runs = []  # [(True for rows or False for columns, {line: net rotation})]
+        for move in self.moves_made:
+            direction, line = move[0], int(move[1:])
+            is_row = direction in 'RL'
+            length = self.width if is_row else self.height
+
+            while runs and not any(runs[-1][1].values()):
+                runs.pop()
+            if not runs or runs[-1][0] != is_row:
+                runs.append((is_row, {}))
+            rotations = runs[-1][1]
+            rotations[line] = (rotations.get(line, 0) + (1 if direction in 'RD' else -1)) % length
+
+        moves = []
+        for is_row, rotations in runs:
+            length = self.width if is_row else self.height
+            forwards, backwards = ('R', 'L') if is_row else ('D', 'U')
+            for line, times in rotations.items():
+                if times <= length - times:
+                    moves.extend([f'{forwards}{line}'] * times)
+                else:
+                    moves.extend([f'{backwards}{line}'] * (length - times))
+
+        self.moves_saved += len(self.moves_made) - len(moves)
+        self.moves_made = moves
+
     def rotate_line(self, line, times):
         return line[-times:] + line[:-times]
 
@@ -0,0 +1,134 @@
+"""Benchmarks the minesweeper solver.
+
+Solves a batch of random boards for each size and density, and prints one JSON object
+summarising each batch, so the results can be used to size workers and tracked for
+regressions:
+
+    python benchmark.py --sizes 10 30 --densities 0.1 0.2 --count 1000 > results.jsonl
+    python benchmark.py --sizes 500 --densities 0.2 --count 3 --backend numpy
+
+Each board starts with a single 0 opened, like the first click of a game,
+and is opened through an in-memory `oracle.LocalBoard`.
+"""
+
+import argparse
+import json
+import random
+from statistics import mean, median
+from time import perf_counter
+
+import rref
+import solver
+from oracle import LocalBoard
+
+
+SIZES = (10, 30, 100)
+
+# The chance of each square being a mine. Expert boards have a density of about 0.2.
+DENSITIES = (0.1, 0.15, 0.2)
+
+
+def generate_board(width, height, density, seed):
+    """Return a random solved board, in the same format as the kata, and the (row, col)
+    of a square to start from. The start and its borders are kept free of mines, so the
+    start is always a 0."""
+    rng = random.Random(seed)
+    start = rng.randrange(height), rng.randrange(width)
+    safe = {(start[0] + dy, start[1] + dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)}
+    squares = [(y, x) for y in range(height) for x in range(width) if (y, x) not in safe]
+    mines = set(rng.sample(squares, min(round(width * height * density), len(squares))))
+
+    def get_value(y, x):
+        if (y, x) in mines:
+            return 'x'
+        return str(sum((y + dy, x + dx) in mines for dy in (-1, 0, 1) for dx in (-1, 0, 1)))
+
+    solution = '\n'.join(
+        ' '.join(get_value(y, x) for x in range(width)) for y in range(height)
+    )
+    return solution, start
+
+
+def solve_board(solution, start, backend):
+    """Solves the board once. Returns whether it was solved,
+    the time taken and a dict of the solver's counters."""
+    board = LocalBoard(solution)
+    grid, width, height = solver.parse_grid(board.puzzle(start))
+
+    begin = perf_counter()
+    ms = solver.Minesweeper(grid, width, height, board.mines, backend=backend, oracle=board)
+    ms.solve()
+    elapsed = perf_counter() - begin
+
+    solved = -1 not in ms.grid
+    if solved and solver.print_grid(ms.grid, width, height) != solution:
+        raise AssertionError('the solver returned the wrong grid')
+    return solved, elapsed, {
+        'logic_calls': ms.logic_calls,
+        'logic_time': ms.logic_time,
+        'rref_calls': ms.rref_calls,
+        'matrix_sizes': ms.matrix_sizes,
+        'probability_calls': ms.probability_calls,
+        'requests': board.requests,
+    }
+
+
+def run(size, density, count=100, seed=0, backend='auto'):
+    """Benchmarks the solver on `count` boards of `size` x `size`, returning a summary"""
+    solved = 0
+    times = []
+    logic_time = 0
+    logic_calls = []
+    rref_calls = []
+    probability_calls = []
+    matrix_sizes = []
+    requests = []
+    for i in range(count):
+        solution, start = generate_board(size, size, density, seed + i)
+        board_solved, elapsed, counters = solve_board(solution, start, backend)
+        solved += board_solved
+        times.append(elapsed)
+        logic_time += counters['logic_time']
+        logic_calls.append(counters['logic_calls'])
+        rref_calls.append(counters['rref_calls'])
+        probability_calls.append(counters['probability_calls'])
+        matrix_sizes.extend(counters['matrix_sizes'])
+        requests.append(counters['requests'])
+
+    return {
+        'size': size,
+        'density': density,
+        'boards': count,
+        'backend': backend,
+        'solve_rate': round(solved / count, 4),
+        'mean_time': round(mean(times), 6),
+        'median_time': round(median(times), 6),
+        'max_time': round(max(times), 6),
+        'logic_share': round(logic_time / sum(times), 4) if sum(times) else 0,
+        'logic_calls': round(mean(logic_calls), 2),
+        'rref_calls': round(mean(rref_calls), 2),
+        'probability_calls': round(mean(probability_calls), 2),
+        'mean_matrix_rows': round(mean(rows for rows, _ in matrix_sizes), 2) if matrix_sizes else 0,
+        'mean_matrix_cols': round(mean(cols for _, cols in matrix_sizes), 2) if matrix_sizes else 0,
+        'max_matrix_size': max(matrix_sizes, key=lambda size: size[0] * size[1], default=(0, 0)),
+        'requests': round(mean(requests), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--densities', type=float, nargs='+', default=DENSITIES)
+    parser.add_argument('--count', type=int, default=100, help='boards per size and density')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=['auto', *rref.BACKENDS], default='auto')
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        for density in args.densities:
+            result = run(size, density, args.count, args.seed, args.backend)
+            print(json.dumps(result), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Oracles which open squares for the minesweeper solver.
+
+The kata provides a global `open(row, col)` function, but the board could just as well be
+behind a game server, where every request is a round trip. An oracle can open many squares
+in one request with `open_many`, which the solver uses whenever it knows several squares
+are safe at once.
+
+`AsyncOracle` is the asyncio version, for use with `solver.solve_mine_async`, and
+`LocalBoard` is an in-memory board for testing the solver without the kata or a server.
+"""
+
+import asyncio
+
+
+class MineExploded(Exception):
+    pass
+
+
+class Oracle:
+    """Opens squares, returning the amount of mines around them.
+    Subclasses need to implement at least one of `open` and `open_many`."""
+
+    def open(self, row, col):
+        return self.open_many([(row, col)])[0]
+
+    def open_many(self, cells):
+        """Open every (row, col) in `cells`, returning a list of their values"""
+        return [self.open(row, col) for row, col in cells]
+
+
+class FunctionOracle(Oracle):
+    """Opens squares one at a time with a function such as the kata's `open(row, col)`"""
+
+    def __init__(self, func):
+        self.func = func
+
+    def open(self, row, col):
+        return self.func(row, col)
+
+
+class LocalBoard(Oracle):
+    """An in-memory board, given as the solved grid in the same format as the kata,
+    where 'x' is a mine. Counts the requests made and the squares opened."""
+
+    def __init__(self, solution):
+        self.solution = solution
+        self.rows = [row.split() for row in solution.splitlines()]
+        self.width = len(self.rows[0])
+        self.height = len(self.rows)
+        self.mines = sum(row.count('x') for row in self.rows)
+        self.requests = 0
+        self.opened = 0
+
+    def open(self, row, col):
+        self.requests += 1
+        return self.open_square(row, col)
+
+    def open_many(self, cells):
+        self.requests += 1
+        return [self.open_square(row, col) for row, col in cells]
+
+    def open_square(self, row, col):
+        if self.rows[row][col] == 'x':
+            raise MineExploded(f'opened a mine at ({row}, {col})')
+        self.opened += 1
+        return int(self.rows[row][col])
+
+    def puzzle(self, start=None):
+        """Return the starting grid for the solver, with only the 0s shown,
+        or only the 0 at `start` (row, col) if it is given"""
+        return '\n'.join(
+            ' '.join(
+                sq if sq == '0' and (start is None or (row, col) == start) else '?'
+                for col, sq in enumerate(squares)
+            )
+            for row, squares in enumerate(self.rows)
+        )
+
+
+class AsyncOracle:
+    """The asyncio version of `Oracle`.
+    Subclasses need to implement at least one of `open` and `open_many`."""
+
+    async def open(self, row, col):
+        return (await self.open_many([(row, col)]))[0]
+
+    async def open_many(self, cells):
+        return [await self.open(row, col) for row, col in cells]
+
+
+class AsyncLocalBoard(AsyncOracle):
+    """Wraps an `Oracle` such as a `LocalBoard`, waiting `latency` seconds on every
+    request to stand in for the round trip to a game server."""
+
+    def __init__(self, oracle, latency=0):
+        self.oracle = oracle
+        self.latency = latency
+
+    async def open_many(self, cells):
+        await asyncio.sleep(self.latency)
+        return self.oracle.open_many(cells)
+
+
+class ThreadsafeOracle(Oracle):
+    """Lets the solver, running in another thread, use an `AsyncOracle` by running
+    each request on the event loop `loop` and waiting for the result."""
+
+    def __init__(self, oracle, loop):
+        self.oracle = oracle
+        self.loop = loop
+
+    def open_many(self, cells):
+        return asyncio.run_coroutine_threadsafe(self.oracle.open_many(cells), self.loop).result()
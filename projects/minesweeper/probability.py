@@ -0,0 +1,250 @@
+"""Counts the mine configurations of the unknown squares, to find the chance of each one
+being a mine when row reduction can't solve any more of them.
+
+The unknown squares bordering the opened squares are split into components which share
+no clues, and the configurations of each component are counted on their own. Rather than
+trying every configuration, the squares are assigned one at a time, and the only state
+carried to the next square is how many mines are still needed by the clues which have
+been started but not finished. Configurations which reach the same state are merged and
+counted together, so the work grows with the amount of states instead of doubling with
+each square, which keeps frontiers of 40 or more squares practical.
+
+The counts are kept per number of mines, so the components and the unknown squares that
+no clue touches can be combined with the amount of mines left on the board. On large
+boards the amount of ways to place the interior mines runs to thousands of digits, so the
+components are combined with the logs of the counts rather than the counts themselves.
+An amount of 0 ways is kept exactly as a log of -inf, so squares which are certainly safe
+or certainly mines are still found exactly.
+"""
+
+from math import exp, inf, lgamma, log, nextafter
+
+
+def mine_probabilities(components, interior, mines_left):
+    """Return {square: chance of it being a mine} for every unknown square. The chance is
+    exactly 0 or 1 for the squares which are certainly safe or certainly mines, and a
+    float strictly between them for the rest. `components` is a list of the clues of each
+    component, where each clue is a tuple of (unknown squares around it, mines still
+    needed), and `interior` is a list of the unknown squares that no clue touches.
+    If the clues can't be satisfied, return {}."""
+    counts = []
+    for clues in components:
+        weights, mined = count_configurations(clues, mines_left)
+        counts.append((to_logs(weights), {
+            square: (to_logs(ways), to_logs(map(int.__sub__, weights, ways)))
+            for square, ways in mined.items()
+        }))
+
+    # before[i][k] is the amount of ways to place k mines in the components before i
+    before = [[0.0]]
+    for weights, _ in counts:
+        before.append(log_multiply(before[-1], weights, mines_left))
+
+    # ways[k] is the amount of ways to place the rest of the mines in the interior
+    # when the components have k mines between them
+    ways = interior_ways(len(interior), mines_left, len(before[-1]) - 1)
+    if log_sum(map(float.__add__, before[-1], ways)) == -inf:
+        return {}
+
+    probabilities = {}
+    # after[k] is the amount of ways to complete the board from the current component,
+    # when the components before it have k mines between them. Working backwards, every
+    # component shares it rather than multiplying the other components together again.
+    after = ways
+    for i in reversed(range(len(counts))):
+        weights, mined = counts[i]
+        # The amount of ways to complete the board when this component has k mines
+        rest = [
+            log_sum(b + after[j + k] for j, b in enumerate(before[i][:len(after) - k]))
+            for k in range(len(weights))
+        ]
+        for square, (mine_ways, safe_ways) in mined.items():
+            probabilities[square] = chance(
+                log_sum(map(float.__add__, mine_ways, rest)),
+                log_sum(map(float.__add__, safe_ways, rest)),
+            )
+        after = [
+            log_sum(w + after[k + m] for m, w in enumerate(weights[:len(after) - k]))
+            for k in range(len(before[i]))
+        ]
+
+    if interior:
+        # Each interior square is a mine in `mines / len(interior)` of the ways
+        size = len(interior)
+        mine_ways = safe_ways = -inf
+        for k, (count, interior_count) in enumerate(zip(before[-1], ways)):
+            mines = mines_left - k
+            if mines > 0:
+                mine_ways = log_sum((mine_ways, count + interior_count + log(mines)))
+            if mines < size:
+                safe_ways = log_sum((safe_ways, count + interior_count + log(size - mines)))
+        probabilities.update(dict.fromkeys(interior, chance(mine_ways, safe_ways)))
+    return probabilities
+
+
+def chance(mine_ways, safe_ways):
+    """Return the chance of a square being a mine, from the logs of the amount of ways
+    it is a mine and it is safe. Only returns exactly 0 or 1 if one of them is 0 ways,
+    however small the chance is."""
+    if mine_ways == -inf:
+        return 0
+    if safe_ways == -inf:
+        return 1
+    return min(1 / (1 + exp(min(safe_ways - mine_ways, 700))), nextafter(1, 0))
+
+
+def interior_ways(size, mines_left, max_mines):
+    """Return [log(comb(size, mines_left - k)) for k in range(max_mines + 1)],
+    with -inf where there are no ways"""
+    ways = []
+    for k in range(max_mines + 1):
+        mines = mines_left - k
+        if 0 <= mines <= size:
+            ways.append(lgamma(size + 1) - lgamma(mines + 1) - lgamma(size - mines + 1))
+        else:
+            ways.append(-inf)
+    return ways
+
+
+def count_configurations(clues, max_mines):
+    """Count the mine configurations of one component with at most `max_mines` mines.
+    Return (weights, mined), where weights[k] is the amount of configurations with k mines,
+    and mined[square][k] is the amount of those where `square` is a mine."""
+    squares = order_squares(clues)
+    index = {square: i for i, square in enumerate(squares)}
+    length = len(squares)
+
+    # For each square, the clues that start at it, and (clue, squares of the clue after it)
+    # for every clue it is in. The clues started but not finished before each square are
+    # the state, in the order of `unfinished[i]`.
+    starts = [[] for _ in range(length)]
+    contains = [[] for _ in range(length)]
+    unfinished = [[] for _ in range(length + 1)]
+    for j, (clue_squares, _) in enumerate(clues):
+        indexes = sorted(index[square] for square in clue_squares)
+        starts[indexes[0]].append(j)
+        for k, i in enumerate(indexes):
+            contains[i].append((j, len(indexes) - k - 1))
+        for i in range(indexes[0] + 1, indexes[-1] + 1):
+            unfinished[i].append(j)
+
+    def step(i, state, mine):
+        """Return the state after square `i`, or None if the clues can't be satisfied"""
+        needed = dict(zip(unfinished[i], state))
+        for j in starts[i]:
+            needed[j] = clues[j][1]
+        for j, squares_left in contains[i]:
+            needed[j] -= mine
+            if not 0 <= needed[j] <= squares_left:
+                return None
+        return tuple(needed[j] for j in unfinished[i + 1])
+
+    # forward[i] holds {state: configurations of the squares before i reaching it},
+    # keeping each count per number of mines
+    forward = [{(): [1]}]
+    for i in range(length):
+        layer = {}
+        for state, ways in forward[i].items():
+            for mine in (0, 1):
+                new_state = step(i, state, mine)
+                if new_state is not None:
+                    layer[new_state] = add(layer.get(new_state, []), shift(ways, mine, max_mines))
+        forward.append(layer)
+
+    # backward[state] holds the configurations of the squares from i onwards which
+    # satisfy every clue starting from that state
+    backward = {(): [1]}
+    mined = {}
+    for i in reversed(range(length)):
+        layer = {}
+        mined_ways = []
+        for state, ways in forward[i].items():
+            completions = []
+            for mine in (0, 1):
+                new_state = step(i, state, mine)
+                if new_state is None or new_state not in backward:
+                    continue
+                rest = shift(backward[new_state], mine, max_mines)
+                completions = add(completions, rest)
+                if mine:
+                    mined_ways = add(mined_ways, multiply(ways, rest, max_mines))
+            if any(completions):
+                layer[state] = completions
+        backward = layer
+        mined[squares[i]] = mined_ways
+
+    weights = backward.get((), [])
+    for square, ways in mined.items():
+        mined[square] = ways + [0] * (len(weights) - len(ways))
+    return weights, mined
+
+
+def order_squares(clues):
+    """Return the squares of the clues in breadth first order through the clues they share,
+    starting from a square in the fewest clues. Neighbouring squares then end up close
+    together, so each clue is finished soon after it is started and the state stays small."""
+    clues_of = {}
+    for j, (clue_squares, _) in enumerate(clues):
+        for square in clue_squares:
+            clues_of.setdefault(square, []).append(j)
+
+    order = []
+    seen = set()
+    for start in sorted(clues_of, key=lambda square: len(clues_of[square])):
+        if start in seen:
+            continue
+        seen.add(start)
+        queue = [start]
+        for square in queue:
+            order.append(square)
+            for j in clues_of[square]:
+                for other in clues[j][0]:
+                    if other not in seen:
+                        seen.add(other)
+                        queue.append(other)
+    return order
+
+
+def shift(ways, mines, max_mines):
+    """Return the counts `ways` with `mines` more mines in every configuration"""
+    return ([0] * mines + ways)[:max_mines + 1]
+
+
+def add(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    return [x + y for x, y in zip(a, b)] + a[len(b):]
+
+
+def multiply(a, b, max_mines):
+    """Return the counts of combining every configuration counted in `a` with every one
+    counted in `b`, leaving out any with more than `max_mines` mines"""
+    product = [0] * min(len(a) + len(b) - 1, max_mines + 1)
+    for i, x in enumerate(a):
+        if not x:
+            continue
+        for j, y in enumerate(b[:len(product) - i]):
+            product[i + j] += x * y
+    return product
+
+
+def to_logs(counts):
+    return [log(count) if count else -inf for count in counts]
+
+
+def log_sum(logs):
+    """Return the log of the sum of the numbers with the logs `logs`"""
+    logs = [x for x in logs if x != -inf]
+    if not logs:
+        return -inf
+    top = max(logs)
+    return top + log(sum(exp(x - top) for x in logs))
+
+
+def log_multiply(a, b, max_mines):
+    """The same as `multiply`, with the logs of the counts"""
+    length = min(len(a) + len(b) - 1, max_mines + 1)
+    return [
+        log_sum(a[i] + b[k - i] for i in range(max(0, k - len(b) + 1), min(k + 1, len(a))))
+        for k in range(length)
+    ]
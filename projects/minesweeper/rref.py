@@ -1,3 +1,32 @@
+"""Row reduction backends for the minesweeper solver.
+
+Every backend takes a matrix as a list of rows, with the totals in the last column, and
+returns it in reduced row echelon form (not necessarily with leading 1s):
+- `float`: divides by each pivot, so the rows may contain fractions
+- `floor`: floor divides by each pivot, so it is only correct when every pivot is 1 or -1
+- `bareiss`: fraction-free Gauss-Jordan elimination, exact on any integer matrix
+- `numpy`: vectorised floating point elimination, for large matrices
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# The amount of columns from which `auto` uses numpy, if it is installed
+NUMPY_MIN_SIZE = 200
+
+
+def reduce(matrix, backend='auto'):
+    """Row reduce `matrix` with one of `BACKENDS`. `auto` uses numpy on large
+    matrices if it is installed, and Bareiss elimination otherwise."""
+    if backend == 'auto':
+        large = matrix and len(matrix[0]) >= NUMPY_MIN_SIZE
+        backend = 'numpy' if np is not None and large else 'bareiss'
+    return BACKENDS[backend](matrix)
+
+
 def rref(matrix):
     if not matrix:
         return []
@@ -61,6 +90,76 @@ def frref(matrix):
     return matrix
 
 
+def bareiss_rref(matrix):
+    """Fraction-free Gauss-Jordan elimination. Each row is multiplied by the pivot, and the
+    pivot row times the row's value in the pivot column is subtracted, so every entry stays
+    an integer. Dividing by the previous pivot is always exact and stops the entries growing.
+    Every pivot ends up as the same value (the determinant of the pivot columns)."""
+    if not matrix:
+        return []
+    width = len(matrix[0])
+    height = len(matrix)
+    m = 0
+    n = 0
+    prev_pivot = 1
+    while n < width and m < height:
+        for i in range(m, height):
+            if matrix[i][n] != 0:
+                if i != m:
+                    matrix[i], matrix[m] = matrix[m], matrix[i]
+                break
+        else:
+            n += 1
+            continue
+        pivot_row = matrix[m]
+        pivot = pivot_row[n]
+        for i, row in enumerate(matrix):
+            if i == m:
+                continue
+            coef = row[n]
+            for j in range(width):
+                row[j] = (row[j] * pivot - pivot_row[j] * coef) // prev_pivot
+        prev_pivot = pivot
+        m += 1
+        n += 1
+    return matrix
+
+
+def numpy_rref(matrix, tolerance=1e-9):
+    """Gauss-Jordan elimination with numpy, choosing the largest pivot in each column to
+    keep the rounding errors small. Values within `tolerance` of 0 are set to 0."""
+    if np is None:
+        raise ImportError('the numpy backend needs numpy to be installed')
+    if not matrix:
+        return []
+    matrix = np.array(matrix, dtype=float)
+    height, width = matrix.shape
+    m = 0
+    for n in range(width):
+        if m == height:
+            break
+        i = m + np.argmax(np.abs(matrix[m:, n]))
+        if abs(matrix[i, n]) < tolerance:
+            matrix[m:, n] = 0
+            continue
+        matrix[[m, i]] = matrix[[i, m]]
+        matrix[m] /= matrix[m, n]
+        coefs = matrix[:, n].copy()
+        coefs[m] = 0
+        matrix -= np.outer(coefs, matrix[m])
+        m += 1
+    matrix[np.abs(matrix) < tolerance] = 0
+    return matrix.tolist()
+
+
+BACKENDS = {
+    'float': rref,
+    'floor': frref,
+    'bareiss': bareiss_rref,
+    'numpy': numpy_rref,
+}
+
+
 def main():
     # matrix = [
     #     [1, 1, 1, 1, 0, 0, 0, 1],
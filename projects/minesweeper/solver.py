@@ -1,19 +1,151 @@
-def solve_mine(grid, n):
-    ms = Minesweeper(parse_grid(grid), n)
+import asyncio
+from math import gcd, isclose
+from time import perf_counter
+
+import probability
+import rref
+from oracle import FunctionOracle, ThreadsafeOracle
+
+
+def solve_mine(grid, n, **kwargs):
+    ms = Minesweeper(*parse_grid(grid), n, **kwargs)
     ms.solve()
-    return '?' if -1 in ms.grid.values() else print_grid(ms.grid, ms.width, ms.height)
+    return '?' if -1 in ms.grid else print_grid(ms.grid, ms.width, ms.height)
+
+
+async def solve_mine_async(grid, n, oracle, **kwargs):
+    """Solve the grid with an `oracle.AsyncOracle`. The solver runs in a worker thread,
+    so the event loop is free to handle the requests (and anything else) meanwhile."""
+    threadsafe = ThreadsafeOracle(oracle, asyncio.get_running_loop())
+    return await asyncio.to_thread(solve_mine, grid, n, oracle=threadsafe, **kwargs)
+
+
+def open_square(row, col):
+    """Open a square with the global `open` function provided by the kata"""
+    return open(row, col)
 
 
 def parse_grid(grid):
-    return {x + 1j * y: 0 if sq == '0' else -1
-            for y, row in enumerate(grid.splitlines())
-            for x, sq in enumerate(row.split())}
+    """Return the grid as a flat list of squares, along with its width and height.
+    The square at (row, col) is at index `row * width + col`."""
+    rows = [row.split() for row in grid.splitlines()]
+    flat = [0 if sq == '0' else -1 for row in rows for sq in row]
+    return flat, len(rows[0]), len(rows)
 
 
 def print_grid(grid, width, height):
-    printed = '\n'.join(' '.join('?' if grid[x + 1j * y] == -1 else 'x' if grid[x + 1j * y] == -2
-                                 else str(grid[x + 1j * y]) for x in range(width)) for y in range(height))
-    return printed
+    symbols = ['?' if val == -1 else 'x' if val == -2 else str(val) for val in grid]
+    return '\n'.join(' '.join(symbols[y * width:(y + 1) * width]) for y in range(height))
+
+
+def get_neighbours(width, height):
+    """Return a table of the indexes of the squares bordering each square"""
+    neighbours = []
+    for y in range(height):
+        for x in range(width):
+            neighbours.append(tuple(
+                ny * width + nx
+                for ny in range(max(y - 1, 0), min(y + 2, height))
+                for nx in range(max(x - 1, 0), min(x + 2, width))
+                if ny != y or nx != x
+            ))
+    return neighbours
+
+
+class Constraints:
+    """A system of linear equations over squares which are either 0 (safe) or 1 (a mine),
+    kept in reduced row echelon form between calls to `Minesweeper.do_logic`.
+
+    Each row is stored sparsely as {square: coefficient} and a total, keyed by its pivot
+    square, which appears in no other row. The rows are only ever combined by multiplying
+    them by whole numbers, so all the coefficients stay as exact integers.
+    `self.columns` holds which rows each square appears in, so adding a row or substituting
+    a solved square only touches the rows which share a square with it."""
+
+    def __init__(self):
+        self.rows = {}
+        self.columns = {}
+        # Rows which have changed since their deductions were last checked
+        self.dirty = set()
+
+    def add(self, coefs, total):
+        """Add the equation `sum(coef * square) == total`,
+        where none of the squares have been substituted yet."""
+        coefs = dict(coefs)
+        for square in [square for square in coefs if square in self.rows]:
+            coefs, total = self.eliminate(coefs, total, square)
+        coefs, total = self.normalise(coefs, total)
+        if not coefs:
+            return
+
+        pivot = min(coefs)
+        if coefs[pivot] < 0:
+            coefs = {square: -coef for square, coef in coefs.items()}
+            total = -total
+
+        # Remove the new pivot from every other row
+        for other in list(self.columns.get(pivot, ())):
+            old = self.rows[other][0]
+            new, new_total = self.eliminate(*self.rows[other], pivot, (coefs, total))
+            self.set_row(other, *self.normalise(new, new_total), old)
+
+        self.set_row(pivot, coefs, total)
+
+    def substitute(self, square, val):
+        """Replace `square` with its solved value in every row it appears in"""
+        for pivot in list(self.columns.pop(square, ())):
+            coefs, total = self.rows.pop(pivot)
+            self.dirty.discard(pivot)
+            coefs = dict(coefs)
+            total -= coefs.pop(square) * val
+            for other in coefs:
+                self.columns[other].discard(pivot)
+            # The row might have lost its pivot, so it is added again to find a new one
+            self.add(coefs, total)
+        # Re-adding the rows can add `square` back to the rows still to be substituted
+        self.columns.pop(square, None)
+
+    def deductions(self):
+        """Yield (square, value) for every square which can only have one value.
+        Each row has a minimum total when the squares with a positive coefficient are 0
+        and the rest are 1, and a maximum total the other way round. If the total of the
+        row is either of these, then every square in it is solved."""
+        while self.dirty:
+            coefs, total = self.rows[self.dirty.pop()]
+            if total == sum(coef for coef in coefs.values() if coef > 0):
+                yield from ((square, int(coef > 0)) for square, coef in coefs.items())
+            elif total == sum(coef for coef in coefs.values() if coef < 0):
+                yield from ((square, int(coef < 0)) for square, coef in coefs.items())
+
+    def set_row(self, pivot, coefs, total, old=()):
+        for square in old:
+            if square not in coefs:
+                self.columns[square].discard(pivot)
+        for square in coefs:
+            self.columns.setdefault(square, set()).add(pivot)
+        self.rows[pivot] = (coefs, total)
+        self.dirty.add(pivot)
+
+    def eliminate(self, coefs, total, square, row=None):
+        """Return the row `coefs` with `square` cancelled out using
+        the row with `square` as its pivot, or `row` if it is given."""
+        pivot_coefs, pivot_total = row or self.rows[square]
+        mult, pivot_mult = pivot_coefs[square], coefs[square]
+        new = {s: coef * mult for s, coef in coefs.items()}
+        for s, coef in pivot_coefs.items():
+            new[s] = new.get(s, 0) - coef * pivot_mult
+            if not new[s]:
+                del new[s]
+        return new, total * mult - pivot_total * pivot_mult
+
+    @staticmethod
+    def normalise(coefs, total):
+        """Divide the row by the greatest common divisor of its coefficients"""
+        divisor = gcd(*coefs.values())
+        if divisor > 1 and total % divisor == 0:
+            coefs = {square: coef // divisor for square, coef in coefs.items()}
+            total //= divisor
+        return coefs, total
 
 
 class Minesweeper:
@@ -21,6 +153,7 @@ class Minesweeper:
     >= 0: clue,
     -1: unknown
     -2: mine(flagged)
+    The grid is a flat list, so the square at (row, col) is at `row * width + col`.
     When a square is opened, the value in `self.grid` is set to the
     the clue in the opened square. The value in `self.active` is set to
     the value of the clue - flagged mines in the 8 border squares around it.
@@ -28,17 +161,43 @@ class Minesweeper:
     the 8 border squares, if any of them are also in `self.active`, then the value
     in `self.active` is decremented by 1."""
 
-    def __init__(self, grid, mines_left):
+    def __init__(self, grid, width, height, mines_left, backend='auto', oracle=None):
         self.grid = grid
         self.mines_left = mines_left
-        self.width = max(int(x.real) for x in grid) + 1
-        self.height = max(int(x.imag) for x in grid) + 1
+        self.width = width
+        self.height = height
+        self.neighbours = get_neighbours(width, height)
+        # Which of `rref.BACKENDS` to row reduce the whole board with
+        self.backend = backend
+        # What opens the squares, which is the kata's `open` function by default
+        self.oracle = oracle or FunctionOracle(open_square)
+        # The chance of each unknown square being a mine, from the last time
+        # `update_probabilities` was needed
+        self.probabilities = {}
 
-        self.BORDER_MEMO = {}
-        self.POS_KEYS = {pos: (int(pos.imag), int(pos.real)) for pos in grid}
+        # Counters for benchmarking
+        self.logic_calls = 0
+        self.logic_time = 0
+        self.rref_calls = 0
+        # The (rows, columns) of every matrix row reduced
+        self.matrix_sizes = []
+        self.probability_calls = 0
 
-        self.active = {pos: val for pos, val in grid.items()
-                       if val != -1 and any(grid[v] == -1 for v in self.get_borders(pos))}
+        self.active = {pos: val for pos, val in enumerate(grid)
+                       if val != -1 and any(grid[v] == -1 for v in self.neighbours[pos])}
+        # The amount of unknown squares around each active square
+        self.unknown_around = [0] * len(grid)
+        for pos in self.active:
+            self.unknown_around[pos] = self.count_vals(self.neighbours[pos], -1)
+        # The active squares which have changed since `solve_trivial` last checked them
+        self.dirty = set(self.active)
+        # The active squares which have changed since `solve_pairs` last checked them
+        self.pair_dirty = set()
+
+        self.constraints = Constraints()
+        # The squares solved, and the squares opened, since `self.constraints` was updated
+        self.solved = []
+        self.opened = list(self.active)
 
     def solve(self):
         """Perfom the steps to solve the grid.
@@ -49,83 +208,264 @@ class Minesweeper:
             self.changed = False
             self.solve_trivial()
             if not self.changed:
+                self.solve_pairs()
+            if not self.changed:
+                start = perf_counter()
                 self.do_logic()
+                self.logic_calls += 1
+                self.logic_time += perf_counter() - start
 
     def do_logic(self):
-        """Create a binary matrix of squares that sourround an active square. Set each
-        row equal to the value of that active square. Then row reduce the matrix and apply
-        the rules:
-        - If the sum of the values in the row equal the number of mines and all the values
-          are the same sign, then they are all mines.
-        - If the number of mines is 0 and all the values in the row are the same sign, then
-          they are all not mines."""
+        """Update the constraints with the squares solved and opened since the last call,
+        and apply any of their deductions. If none can be made and every unknown square
+        borders an active square, then try again by row reducing them along with the amount
+        of mines left, as the mine count can link separate groups of squares together.
+        With any interior squares left, the matrix would span the whole board, so that is
+        skipped and the mine count is left to `update_probabilities`, which applies it
+        exactly. If nothing is solved, then count the mine configurations instead."""
+        self.update_constraints()
+        safe = []
+        for pos, val in self.constraints.deductions():
+            if val:
+                self.flag(pos)
+            else:
+                safe.append(pos)
+        self.open_many(safe)
+        if not self.changed:
+            unknowns = list(self.positions_filter(range(len(self.grid)), -1))
+            if all(any(border in self.active for border in self.neighbours[pos])
+                   for pos in unknowns):
+                self.reduce(unknowns, self.active, self.mines_left)
+        if not self.changed:
+            self.update_probabilities()
+
+    def update_constraints(self):
+        """Substitute the solved squares into the constraints, then add a row for the
+        unknown squares around each opened square that is still active."""
+        for pos, val in self.solved:
+            self.constraints.substitute(pos, val)
+        for pos in self.opened:
+            if pos in self.active:
+                unknowns = self.positions_filter(self.neighbours[pos], -1)
+                self.constraints.add(dict.fromkeys(unknowns, 1), self.active[pos])
+        self.solved = []
+        self.opened = []
+
+    def update_probabilities(self):
+        """Count the mine configurations of each group of unknown squares bordering the
+        active squares, and set `self.probabilities` to the chance of each unknown square
+        being a mine. Squares which are never a mine are opened, and squares which are
+        always a mine are flagged."""
+        components = []
+        frontier = set()
+        for unknowns, actives in self.get_components():
+            components.append([
+                (tuple(self.positions_filter(self.neighbours[active], -1)), self.active[active])
+                for active in actives
+            ])
+            frontier.update(unknowns)
+        interior = [pos for pos in self.positions_filter(range(len(self.grid)), -1)
+                    if pos not in frontier]
+
+        self.probability_calls += 1
+        self.probabilities = probability.mine_probabilities(
+            components, interior, self.mines_left
+        )
+        safe = []
+        for pos, chance in self.probabilities.items():
+            if chance == 1:
+                self.flag(pos)
+            elif chance == 0:
+                safe.append(pos)
+        self.open_many(safe)
+
+    def get_components(self):
+        """Split the active squares and the unknown squares around them into groups which
+        share no constraints. Unknown squares that don't border an active square are left
+        out. Return a list of (unknown squares, active squares) for each group."""
+        seen = set()
+        components = []
+        for start in self.active:
+            if start in seen:
+                continue
+            seen.add(start)
+            unknowns, actives = [], []
+            stack = [start]
+            while stack:
+                active = stack.pop()
+                actives.append(active)
+                for pos in self.positions_filter(self.neighbours[active], -1):
+                    if pos in seen:
+                        continue
+                    seen.add(pos)
+                    unknowns.append(pos)
+                    for border in self.neighbours[pos]:
+                        if border in self.active and border not in seen:
+                            seen.add(border)
+                            stack.append(border)
+            if unknowns:
+                components.append((unknowns, actives))
+        return components
+
+    def reduce(self, unknowns, actives, mines_left=None):
+        """Create a binary matrix of the `unknowns` that sourround each active square. Set
+        each row equal to the value of that active square, with an extra row of all the
+        unknowns equal to `mines_left` if it is given. Then row reduce the matrix with
+        `self.backend` and apply the rules:
+        - If the number of mines in the row equals the sum of its positive values, then the
+          squares with a positive value are all mines, and the negative ones are not.
+        - If the number of mines equals the sum of its negative values, then it is the
+          other way round."""
 
         # Which column each position goes in
-        unknown_order = {pos: i for i, pos in enumerate(self.positions_filter(self.grid, -1))}
-        unknown_length = len(unknown_order)
-        # Starts off with all unopened squares to the amount of mines left
-        matrix = [[1] * unknown_length + [self.mines_left]]
-        all_rows = set(tuple(matrix[0]))
-        for active, mines_count in self.active.items():
+        column = {pos: i for i, pos in enumerate(unknowns)}
+        unknown_length = len(unknowns)
+        matrix = []
+        if mines_left is not None:
+            matrix.append([1] * unknown_length + [mines_left])
+        all_rows = set(map(tuple, matrix))
+        for active in actives:
             row = [0] * unknown_length
-            for pos in self.positions_filter(self.get_borders(active), -1):
-                row[unknown_order[pos]] = 1
-            row.append(mines_count)
+            for pos in self.positions_filter(self.neighbours[active], -1):
+                row[column[pos]] = 1
+            row.append(self.active[active])
             tup_row = tuple(row)
             if tup_row not in all_rows:
                 matrix.append(row)
                 all_rows.add(tup_row)
 
-        for *row, mines in self.rref(matrix):
-            if sum(t for t in row if t > 0) == mines:
-                for pos, ind in unknown_order.items():
-                    if row[ind] == 1:
-                        self.flag(pos)
-            elif sum(t for t in row if t < 0) == mines:
-                for pos, ind in unknown_order.items():
-                    if row[ind] == -1:
-                        self.flag(pos)
-            if mines == 0:
-                # We can now open all the non-zero positions
-                if all(t >= 0 for t in row):
-                    for pos, ind in unknown_order.items():
-                        if row[ind] == 1:
-                            self.open_(pos)
-                if all(t <= 0 for t in row):
-                    for pos, ind in unknown_order.items():
-                        if row[ind] == -1:
-                            self.open_(pos)
+        safe = []
+        self.rref_calls += 1
+        self.matrix_sizes.append((len(matrix), unknown_length + 1))
+        for *row, mines in rref.reduce(matrix, self.backend):
+            positive = sum(t for t in row if t > 0)
+            negative = sum(t for t in row if t < 0)
+            if isclose(mines, positive, abs_tol=1e-9):
+                mine_sign = 1
+            elif isclose(mines, negative, abs_tol=1e-9):
+                mine_sign = -1
+            else:
+                continue
+            for pos, t in zip(unknowns, row):
+                if t * mine_sign > 0:
+                    self.flag(pos)
+                elif t:
+                    safe.append(pos)
+        self.open_many(safe)
 
     def solve_trivial(self):
         """Solve trivial cases:
         - If a position has a value of 0, then open all the unflagged positions around it
         - If a position has a value equal to the number of unflagged positions around it,
-          then the surrounding positions must all be mines."""
-        for pos in self.active.copy():
-            val = self.active[pos]
+          then the surrounding positions must all be mines.
+        Only the active squares in `self.dirty` can have changed, so only they are checked.
+        The squares around every 0 are opened together in one request to the oracle."""
+        safe = []
+        while self.dirty:
+            pos = self.dirty.pop()
+            val = self.active.get(pos)
             if val == 0:
-                self.open_around(pos)
-            elif self.count_vals(self.get_borders(pos), -1) == val:
+                safe.extend(self.positions_filter(self.neighbours[pos], -1))
+                self.active.pop(pos)
+            elif val is not None and self.unknown_around[pos] == val:
                 self.flag_around(pos)
+            elif val is not None:
+                self.pair_dirty.add(pos)
+        self.open_many(safe)
 
-    def open_around(self, pos):
-        """Open the squares around `pos`. `pos` is then removed from `self.active`"""
-        for border in self.get_borders(pos):
-            if self.grid[border] == -1:
-                self.open_(border)
-        self.active.pop(pos)
+    def solve_pairs(self):
+        """Compare each changed active square A with the active squares B sharing unknown
+        squares with it. If the x mines in the shared squares can only be a certain amount,
+        then the squares only around A have A - x mines, and the squares only around B have
+        B - x mines. So if either of those is 0 they are all safe, and if it is the amount
+        of squares then they are all mines. For example if A's unknown squares are a subset
+        of B's, then the squares only around B have exactly B - A mines.
+
+        The unknown squares around each active square are held as a bitset in a 7 x 7 frame
+        centred on it, so the bitset of any square up to 2 away can be moved into the same
+        frame with a shift, and the squares are compared with bitwise operations."""
+        safe = set()
+        mines = set()
+        for a in self.pair_dirty:
+            if a not in self.active:
+                continue
+            a_row, a_col = divmod(a, self.width)
+            mask_a = self.unknown_mask(a)
+            partners = {b for pos in self.positions_filter(self.neighbours[a], -1)
+                        for b in self.neighbours[pos] if b != a and b in self.active}
+            for b in partners:
+                b_row, b_col = divmod(b, self.width)
+                shift = (b_row - a_row) * 7 + b_col - a_col
+                mask_b = self.unknown_mask(b)
+                mask_b = mask_b << shift if shift > 0 else mask_b >> -shift
+
+                shared = mask_a & mask_b
+                only_a, only_b = mask_a & ~shared, mask_b & ~shared
+                shared_count = shared.bit_count()
+                val_a, val_b = self.active[a], self.active[b]
+                x_max = min(shared_count, val_a, val_b)
+                x_min = max(0, val_a - only_a.bit_count(), val_b - only_b.bit_count())
+                for only, val in ((only_a, val_a), (only_b, val_b)):
+                    if not only:
+                        continue
+                    if val - x_max == only.bit_count():
+                        mines.update(self.unmask(a, only))
+                    elif val - x_min == 0:
+                        safe.update(self.unmask(a, only))
+        self.pair_dirty.clear()
+
+        for pos in mines:
+            self.flag(pos)
+        self.open_many(safe)
+
+    def unknown_mask(self, pos):
+        """Return the bitset of the unknown squares around `pos`, in the 7 x 7 frame centred
+        on it, where the square at (row, col) from the centre is bit `(row + 3) * 7 + col + 3`"""
+        row, col = divmod(pos, self.width)
+        mask = 0
+        for border in self.positions_filter(self.neighbours[pos], -1):
+            border_row, border_col = divmod(border, self.width)
+            mask |= 1 << (border_row - row + 3) * 7 + border_col - col + 3
+        return mask
 
-    def open_(self, pos):
-        if self.grid[pos] != -1:
+    def unmask(self, pos, mask):
+        """Return the squares in the bitset `mask` in the frame centred on `pos`"""
+        squares = []
+        while mask:
+            bit = mask & -mask
+            row, col = divmod(bit.bit_length() - 1, 7)
+            squares.append(pos + (row - 3) * self.width + col - 3)
+            mask ^= bit
+        return squares
+
+    def open_many(self, positions):
+        """Open the unknown squares in `positions` with a single request to the oracle"""
+        positions = [pos for pos in dict.fromkeys(positions) if self.grid[pos] == -1]
+        if not positions:
             return
-        val = open(*self.POS_KEYS[pos])
-        self.grid[pos] = val
-        self.active[pos] = val - self.count_vals(self.get_borders(pos), -2)
+        values = self.oracle.open_many([divmod(pos, self.width) for pos in positions])
+        for pos, val in zip(positions, values):
+            self.grid[pos] = val
+            unknown = flagged = 0
+            for border in self.neighbours[pos]:
+                border_val = self.grid[border]
+                if border_val == -1:
+                    unknown += 1
+                elif border_val == -2:
+                    flagged += 1
+                elif border in self.active:
+                    self.unknown_around[border] -= 1
+                    self.dirty.add(border)
+            self.active[pos] = val - flagged
+            self.unknown_around[pos] = unknown
+            self.dirty.add(pos)
+            self.solved.append((pos, 0))
+            self.opened.append(pos)
         self.changed = True
 
     def flag_around(self, pos):
         """Flag the squares around `pos`. `pos` is then removed from `self.active`"""
-        for border in self.get_borders(pos):
+        for border in self.neighbours[pos]:
             if self.grid[border] == -1:
                 self.flag(border)
         self.active.pop(pos)
@@ -135,11 +475,14 @@ class Minesweeper:
             return
         self.mines_left -= 1
         self.grid[pos] = -2
+        self.solved.append((pos, 1))
 
         # Decrement the value of active squares around `pos` by 1
-        for border in self.get_borders(pos):
+        for border in self.neighbours[pos]:
             if border in self.active:
                 self.active[border] -= 1
+                self.unknown_around[border] -= 1
+                self.dirty.add(border)
         self.changed = True
 
     def count_vals(self, positions, val):
@@ -149,47 +492,3 @@ class Minesweeper:
     def positions_filter(self, positions, val):
         """Return an iterable of positions in `positions` that have the value `val`"""
         return (pos for pos in positions if self.grid[pos] == val)
-
-    def get_borders(self, pos):
-        """Return a set of the positions that border `pos`"""
-        memo = self.BORDER_MEMO.get(pos)
-        if memo:
-            return memo
-        borders = {pos + move for move in (1, -1, 1j, -1j, 1 + 1j, 1 - 1j, -1 + 1j, -1 - 1j)
-                   if pos + move in self.grid}
-        self.BORDER_MEMO[pos] = borders
-        return borders
-
-    @staticmethod
-    def rref(matrix):
-        """Row reduce the matrix. Will only work on a binary matrix or
-        where the square matrix of the size m x m only contains 1 or 0."""
-        if not matrix:
-            return []
-        width = len(matrix[0])
-        height = len(matrix)
-        m = 0
-        n = 0
-        while n < width and m < height:
-            for i in range(m, height):
-                if matrix[i][n] != 0:
-                    if i != m:
-                        matrix[i], matrix[m] = matrix[m], matrix[i]
-                    break
-            else:
-                n += 1
-                continue
-            pivot_row = matrix[m]
-            pivot = pivot_row[n]
-            for i in range(n, len(pivot_row)):
-                pivot_row[i] //= pivot
-            for i, row in enumerate(matrix):
-                if i == m:
-                    continue
-                coef = row[n]
-                row[n] = 0
-                for j in range(n + 1, len(row)):
-                    row[j] -= pivot_row[j] * coef
-            m += 1
-            n += 1
-        return matrix
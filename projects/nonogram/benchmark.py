@@ -0,0 +1,171 @@
+"""Benchmarks the nonogram solvers.
+
+Solves a corpus of puzzles with each solver and prints one JSON object per run,
+so the results can be compared between engines and tracked for regressions:
+
+    python benchmark.py --sizes 5 10 20 --difficulties easy hard > results.jsonl
+    python benchmark.py --corpus puzzles.json --solvers overlap dp
+
+The corpus is either generated from random grids, or loaded from a JSON file
+containing a list of {"name": ..., "width": ..., "height": ..., "clues": [cols, rows]}.
+"""
+
+import argparse
+import json
+import random
+import tracemalloc
+from itertools import groupby
+from time import perf_counter
+
+import brute_force_solver
+import solver
+
+
+SIZES = (5, 10, 15, 20, 30, 50, 75, 100)
+
+# The chance of each square being filled. The sparser the grid, the more
+# ambiguous the lines are, so the harder puzzles need guessing to be solved.
+DIFFICULTIES = {'easy': 0.7, 'medium': 0.6, 'hard': 0.5}
+
+# {name: keyword arguments for solver.Nonogram}, or None for the brute force solver
+SOLVERS = {
+    'brute_force': None,
+    'overlap': {},
+    'dp': {'engine': 'dp'},
+    'probe': {'branching': 'probe'},
+    'dp_probe': {'engine': 'dp', 'branching': 'probe', 'learn': True},
+}
+
+# The brute force solver takes exponential time, so it is only run on small grids
+BRUTE_FORCE_MAX_SIZE = 15
+
+
+def get_clue(line):
+    return tuple(len(list(g)) for k, g in groupby(line) if k)
+
+
+def get_clues(grid):
+    """Returns the (column clues, row clues) of a grid of 1s and 0s."""
+    return tuple(map(get_clue, zip(*grid))), tuple(map(get_clue, grid))
+
+
+def generate_puzzle(width, height, difficulty, seed):
+    rng = random.Random(seed)
+    density = DIFFICULTIES[difficulty]
+    grid = [[int(rng.random() < density) for _ in range(width)] for _ in range(height)]
+    return {
+        'name': f'{width}x{height}-{difficulty}-{seed}',
+        'width': width,
+        'height': height,
+        'difficulty': difficulty,
+        'clues': get_clues(grid),
+    }
+
+
+def generate_corpus(sizes=SIZES, difficulties=DIFFICULTIES, count=3, seed=0):
+    return [
+        generate_puzzle(size, size, difficulty, seed + i)
+        for size in sizes
+        for difficulty in difficulties
+        for i in range(count)
+    ]
+
+
+def load_corpus(path):
+    with open(path) as f:
+        puzzles = json.load(f)
+    for puzzle in puzzles:
+        # The clues need to be hashable for the line cache
+        puzzle['clues'] = tuple(tuple(map(tuple, clues)) for clues in puzzle['clues'])
+    return puzzles
+
+
+def solve_puzzle(puzzle, solver_name, timeout):
+    """Solves the puzzle once. Returns the grid (or None if it has no solution or timed
+    out), whether it timed out, and a dict of the solver's counters."""
+    clues, width, height = puzzle['clues'], puzzle['width'], puzzle['height']
+    kwargs = SOLVERS[solver_name]
+    if kwargs is None:
+        try:
+            return brute_force_solver.Nonogram(clues).solve(timeout), False, {}
+        except solver.SolveTimeoutError:
+            return None, True, {}
+
+    nonogram = solver.Nonogram(clues, width, height, **kwargs)
+    grid, timed_out = None, False
+    try:
+        grid = nonogram.solve(timeout)
+    except solver.InvalidGridError:
+        pass
+    except solver.SolveTimeoutError:
+        timed_out = True
+    return grid, timed_out, {
+        'guesses': nonogram.guesses,
+        'backtracks': nonogram.backtracks,
+        'line_solves': nonogram.line_solves,
+    }
+
+
+def run(puzzle, solver_name, timeout=None, memory=True):
+    """Benchmarks one solver on one puzzle. The line cache is cleared first, so every run
+    starts cold. Peak memory is measured in a second run, as tracing slows the solver down."""
+    solver.LINE_CACHE.clear()
+    start = perf_counter()
+    grid, timed_out, counters = solve_puzzle(puzzle, solver_name, timeout)
+    elapsed = perf_counter() - start
+
+    result = {
+        'puzzle': puzzle['name'],
+        'width': puzzle['width'],
+        'height': puzzle['height'],
+        'difficulty': puzzle.get('difficulty'),
+        'solver': solver_name,
+        'time': round(elapsed, 6),
+        'timed_out': timed_out,
+        'solved': grid is not None,
+        'correct': grid is not None and get_clues(grid) == puzzle['clues'],
+        **counters,
+    }
+    if SOLVERS[solver_name] is not None:
+        result['cache'] = solver.LINE_CACHE.stats()
+
+    if memory:
+        solver.LINE_CACHE.clear()
+        tracemalloc.start()
+        solve_puzzle(puzzle, solver_name, timeout)
+        result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', help='JSON file of puzzles, instead of generating them')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument(
+        '--difficulties', nargs='+', choices=DIFFICULTIES, default=list(DIFFICULTIES)
+    )
+    parser.add_argument('--count', type=int, default=3, help='puzzles per size and difficulty')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--solvers', nargs='+', choices=SOLVERS, default=list(SOLVERS))
+    parser.add_argument('--timeout', type=float, default=60, help='seconds per puzzle')
+    parser.add_argument('--no-memory', action='store_true', help='skip measuring peak memory')
+    args = parser.parse_args()
+
+    if args.corpus:
+        puzzles = load_corpus(args.corpus)
+    else:
+        puzzles = generate_corpus(args.sizes, args.difficulties, args.count, args.seed)
+
+    for puzzle in puzzles:
+        for solver_name in args.solvers:
+            if SOLVERS[solver_name] is None and (
+                max(puzzle['width'], puzzle['height']) > BRUTE_FORCE_MAX_SIZE
+            ):
+                continue
+            result = run(puzzle, solver_name, args.timeout, not args.no_memory)
+            print(json.dumps(result), flush=True)
+
+
+if __name__ == '__main__':
+    main()
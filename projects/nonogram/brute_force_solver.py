@@ -1,55 +1,89 @@
-from itertools import product, groupby
+from time import monotonic
 
+from solver import SolveTimeoutError
 
-def get_keys():
-    products = product((0, 1), repeat=5)
-    keys = {}
 
-    for prod in products:
-        key = tuple(map(len, [list(g) for k, g in groupby(prod) if k]))
-        try:
-            keys[key].add(prod)
-        except KeyError:
-            keys[key] = {prod}
+def get_rows(clue, width):
+    """Lazily generates every row of length `width` that matches `clue`."""
+    if not clue:
+        yield (0,) * width
+        return
 
-    return keys
-
-
-KEYS = get_keys()
+    block, rest = clue[0], clue[1:]
+    rest_length = sum(rest) + len(rest)  # Each block after the first needs a gap before it
+    for start in range(width - rest_length - block + 1):
+        head = (0,) * start + (1,) * block
+        if rest:
+            for tail in get_rows(rest, width - start - block - 1):
+                yield head + (0,) + tail
+        else:
+            yield head + (0,) * (width - start - block)
 
 
 class Nonogram:
+    """Places every possible row in turn, backtracking as soon as a column can no longer
+    match its clue. Each column is tracked as (blocks done, length of the current block)."""
+
     def __init__(self, clues):
         self.c_clues = clues[0]
         self.r_clues = clues[1]
+        self.width = len(self.c_clues)
+        self.height = len(self.r_clues)
+
+        # The number of squares each column needs to fit its blocks from `i` onwards
+        self.c_needed = [
+            [sum(clue[i:]) + len(clue[i:]) - 1 for i in range(len(clue))] + [0]
+            for clue in self.c_clues
+        ]
+
+        self.board = [(0,) * self.width for _ in range(self.height)]
+        self.col_states = [[(0, 0)] * self.width]
+
+    def solve(self, timeout=None):
+        """Returns the solved board, or None if there is no solution.
+        Raises SolveTimeoutError if it takes longer than `timeout` seconds."""
+        self.deadline = None if timeout is None else monotonic() + timeout
+        return self.solve_row(0)
+
+    def solve_row(self, row_num):
+        if row_num == self.height:
+            return tuple(self.board)
+
+        for row in get_rows(self.r_clues[row_num], self.width):
+            if self.deadline is not None and monotonic() > self.deadline:
+                raise SolveTimeoutError('Timed out')
+            states = self.place_row(row, row_num)
+            if states is None:
+                continue
 
-        self.board = [tuple(0 for _ in range(5)) for _ in range(5)]
-        self.curr_row = -1
-
-    def solve(self):
-        old_row = self.curr_row
-        self.curr_row += 1
-
-        if self.curr_row == 5:
-            self.curr_row -= 1
-            return self.check_valid()
-
-        row_clue = self.r_clues[self.curr_row]
-        row_num = self.curr_row
-
-        for row in KEYS[row_clue]:
             self.board[row_num] = row
-
-            if self.solve():
+            self.col_states.append(states)
+            if self.solve_row(row_num + 1):
                 return tuple(self.board)
-
-        self.curr_row = old_row
-
-    def check_valid(self):
-        cols = [tuple(self.board[y][x] for y in range(5)) for x in range(5)]
-
-        for i, col in enumerate(cols):
-            clue = self.c_clues[i]
-            if col not in KEYS[clue]:
-                return False
-        return True
+            self.col_states.pop()
+
+    def place_row(self, row, row_num):
+        """Returns the column states after placing `row`,
+        or None if any column can no longer match its clue."""
+        rows_left = self.height - row_num - 1
+        states = []
+        for x, (sq, (done, run)) in enumerate(zip(row, self.col_states[-1])):
+            clue = self.c_clues[x]
+            if sq:
+                run += 1
+                if done == len(clue) or run > clue[done]:
+                    return None
+            elif run:
+                if run != clue[done]:
+                    return None
+                done, run = done + 1, 0
+
+            # Checks the rest of the blocks still fit in the rest of the column
+            if run:
+                needed = clue[done] - run + self.c_needed[x][done + 1] + (done + 1 < len(clue))
+            else:
+                needed = self.c_needed[x][done]
+            if needed > rows_left:
+                return None
+            states.append((done, run))
+        return states
@@ -1,25 +1,182 @@
-from itertools import repeat, groupby, count, chain
+from collections import OrderedDict
+from heapq import heappop, heappush
+from itertools import repeat, count, islice
+from multiprocessing import Pool
+from threading import Lock
+from time import monotonic
 
 
-def solve(*args):
-    return tuple(map(tuple, Nonogram(*args).solve()))
+def solve(*args, **kwargs):
+    return tuple(map(tuple, Nonogram(*args, **kwargs).solve()))
 
 
-class Memo:
-    def __init__(self, func):
-        self.func = func
-        self.cache = {}
+def solve_colour(*args, **kwargs):
+    return tuple(map(tuple, ColourNonogram(*args, **kwargs).solve()))
 
-    def __call__(self, *args):
-        if args in self.cache:
-            return self.cache[args]
-        else:
-            ans = self.func(*args)
-            self.cache[args] = ans
+
+def find_solutions(clues, width, height, limit=2, **kwargs):
+    """Returns a list of up to `limit` different solutions to the puzzle."""
+    solutions = Nonogram(clues, width, height, **kwargs).solutions()
+    return [tuple(map(tuple, grid)) for grid in islice(solutions, limit)]
+
+
+def count_solutions(clues, width, height, limit=2, **kwargs):
+    """Counts the solutions to the puzzle, stopping once `limit` have been found.
+    With the default limit, the puzzle has a unique solution if this returns 1."""
+    return len(find_solutions(clues, width, height, limit, **kwargs))
+
+
+def solve_batch(puzzles, processes=None, timeout=None, cache_size=None, **kwargs):
+    """Solves an iterable of puzzles, each given as `(clues, width, height)`, across a pool
+    of `processes` worker processes (all the cores by default). Yields `(index, solution)`
+    as soon as each puzzle is solved, so the order is not the same as `puzzles`.
+    The solution is None if the puzzle has no solution or took longer than `timeout`
+    seconds, so one bad puzzle doesn't stop the rest of the batch.
+    Every worker keeps its own `LINE_CACHE` warm between puzzles, optionally resized
+    to `cache_size`. Any other keyword arguments are passed to `Nonogram`."""
+    with Pool(processes, initializer=_init_worker, initargs=(cache_size,)) as pool:
+        tasks = ((i, puzzle, timeout, kwargs) for i, puzzle in enumerate(puzzles))
+        yield from pool.imap_unordered(_solve_task, tasks)
+
+
+def _init_worker(cache_size):
+    if cache_size is not None:
+        LINE_CACHE.resize(cache_size)
+
+
+def _solve_task(task):
+    index, (clues, width, height), timeout, kwargs = task
+    try:
+        grid = Nonogram(clues, width, height, **kwargs).solve(timeout)
+    except (InvalidGridError, SolveTimeoutError):
+        return index, None
+    return index, tuple(map(tuple, grid))
+
+
+class LineCache:
+    """A least recently used cache for the line solving functions, which all take
+    `(clue, length, filled, empty)`. One cache is shared by all the functions it wraps
+    (and all the solvers in the process), so `maxsize` bounds their total size.
+    If `compact` is set, each line is keyed by a single bytes object instead of
+    a tuple of the arguments, which uses much less memory per entry.
+    Results are computed outside the lock, so it can be used from several threads."""
+
+    def __init__(self, maxsize=2 ** 17, compact=False):
+        self.maxsize = maxsize
+        self.compact = compact
+        self.lock = Lock()
+        self.funcs = []
+        self.clear()
+
+    def __call__(self, func):
+        tag = len(self.funcs)
+        self.funcs.append(func)
+        lock = self.lock
+        missing = object()
+
+        def wrapper(*args):
+            key = (tag, self.encode(*args)) if self.compact else (tag, *args)
+            with lock:
+                cache = self.cache
+                ans = cache.get(key, missing)
+                if ans is not missing:
+                    self.hits += 1
+                    cache.move_to_end(key)
+                    return ans
+                self.misses += 1
+
+            ans = func(*args)
+
+            with lock:
+                cache = self.cache
+                cache[key] = ans
+                if len(cache) > self.maxsize:
+                    cache.popitem(last=False)
+                    self.evictions += 1
             return ans
 
+        wrapper.__doc__ = func.__doc__
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    @staticmethod
+    def encode(clue, length, *masks):
+        """Packs the line into bytes: the number of values in the clue, then each value
+        (the (length, colour) pairs of colour clues are flattened), then the bitmasks,
+        the length and the number of bitmasks packed into one integer. The number of
+        bitmasks is needed, as otherwise a line with one more colour whose first bitmask
+        is 0 would have the same key."""
+        values = [
+            v for block in clue for v in (block if type(block) is tuple else (block,))
+        ]
+        line = 0
+        for mask in masks:
+            line = line << length | mask
+        line = (line << 16 | length) << 16 | len(masks)
+        size = (line.bit_length() + 7) // 8
+        if len(values) < 255 and all(type(v) is int and 0 <= v < 256 for v in values):
+            return bytes((len(values), *values)) + line.to_bytes(size, 'little')
+        return b'\xff' + repr(clue).encode() + line.to_bytes(size, 'little')
+
+    def clear(self):
+        with self.lock:
+            self.cache = OrderedDict()
+            self.hits = self.misses = self.evictions = 0
+
+    def resize(self, maxsize):
+        """Changes the maximum size, evicting the least recently used lines if needed."""
+        with self.lock:
+            self.maxsize = maxsize
+            while len(self.cache) > maxsize:
+                self.cache.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.cache),
+                'maxsize': self.maxsize,
+            }
+
+
+LINE_CACHE = LineCache()
+
+
+def reverse_bits(bits, length):
+    """Reverses the first `length` bits of `bits`."""
+    return int(format(bits, f'0{length}b')[::-1], 2)
+
 
 class Nonogram:
+    """Every line of the grid is stored as two bitmasks: `filled` has a bit set for each
+    square known to be filled, and `empty` for each square known to be empty. Bit `i` of
+    a row is column `i`, and bit `i` of a column is row `i`. Rows are stored under 'R' and
+    columns under 'C', and both are updated together whenever a square changes.
+
+    Lines are only line solved when a square in them has changed. Changed lines are
+    kept in a priority queue, so the lines with the fewest unknown squares
+    (which are the cheapest to solve and the most likely to be finished) go first.
+
+    `engine` selects how a single line is solved:
+    'overlap': the intersection of the leftmost and rightmost arrangements. Fast,
+               but misses some deductions, which then have to be guessed.
+    'dp': a dynamic program over the line that finds every square forced by the clue.
+
+    `branching` selects which square is guessed when line solving gets stuck:
+    'first': the first unknown square of the unsolved line with the largest clue sum.
+    'constrained': the unknown square whose row and column have the fewest unknowns.
+    'probe': tries both values of the most constrained squares. If one value makes the
+             grid invalid, the square must be the other value, and squares that are the
+             same either way are kept. Only guesses if nothing could be deduced.
+    If `learn` is set, every set of guesses that has been proven to make the grid invalid
+    is remembered, and is never guessed again."""
+
+    ENGINES = {'overlap': 'linesolve_helper', 'dp': 'linesolve_dp'}
+    BRANCHINGS = ('first', 'constrained', 'probe')
+    PROBE_LIMIT = 16  # The most squares that are probed before guessing
 
     __slots__ = [
         'W',
@@ -27,236 +184,866 @@ class Nonogram:
         'no_of_lines',
         'col_clues',
         'row_clues',
-        'grid',
+        'lengths',
+        'clues',
+        'clue_sums',
+        'filled',
+        'empty',
         'to_linesolve',
-        'grid_changed',
+        'queue',
+        'queued',
         'solved_lines',
         'prev_states',
+        'trail',
+        'solved_trail',
+        'engine',
+        'branching',
+        'learn',
+        'contradictions',
+        'guesses',
+        'backtracks',
+        'line_solves',
     ]
 
-    def __init__(self, clues, width, height):
+    def __init__(
+        self, clues, width, height, engine='overlap', branching='first', learn=False
+    ):
+        if engine not in self.ENGINES:
+            raise ValueError(f'Unknown engine: {engine!r}')
+        if branching not in self.BRANCHINGS:
+            raise ValueError(f'Unknown branching: {branching!r}')
+        self.engine = engine
+        self.branching = branching
+        self.learn = learn
+
         self.W, self.H = width, height
         self.no_of_lines = width + height
         self.col_clues, self.row_clues = clues
 
-        self.grid = [[-1 for _ in range(width)] for _ in range(height)]
+        self.lengths = {'R': width, 'C': height}
+        self.clues = {'R': self.row_clues, 'C': self.col_clues}
+        self.clue_sums = {k: list(map(self.clue_sum, v)) for k, v in self.clues.items()}
+        self.init_grid()
 
         self.to_linesolve = sorted(
             list(zip(repeat('C'), count(), self.col_clues))
             + list(zip(repeat('R'), count(), self.row_clues)),
-            key=lambda x: sum(x[2]),
+            key=lambda x: self.clue_sum(x[2]),
             reverse=True,
         )
 
         self.solved_lines = set()  # set of all the solved lines for lookup
 
+        # Heap of (unknown squares, -clue sum, vert, pos) of the lines waiting to be
+        # line solved. `queued` holds the lines in the heap so stale entries can be skipped.
+        self.queue = []
+        self.queued = set()
+        for vert, pos, _ in self.to_linesolve:
+            self.queue_line(vert, pos)
+
         self.prev_states = []  # list of states in case it needs to guess and backtrack
 
-    def solve(self):
+        # Once a guess has been made, every square that is set is recorded on the trail as
+        # (y, x, val), and every line that is solved on the solved trail. Backtracking
+        # only undoes the entries made since the guess, rather than copying the whole grid.
+        self.trail = []
+        self.solved_trail = []
+
+        # {guess: list of the sets of guesses containing it that make the grid invalid}
+        # where each guess is ((y, x), val)
+        self.contradictions = {}
+
+        # Counters for benchmarking
+        self.guesses = 0
+        self.backtracks = 0
+        self.line_solves = 0
+
+    def init_grid(self):
+        self.filled = {'R': [0] * self.H, 'C': [0] * self.W}
+        self.empty = {'R': [0] * self.H, 'C': [0] * self.W}
+
+    @staticmethod
+    def clue_sum(clue):
+        return sum(clue)
+
+    def solve(self, timeout=None):
+        """Returns the first solution found. Raises InvalidGridError if there are none."""
+        for grid in self.solutions(timeout):
+            return grid
+        raise InvalidGridError('Invalid grid')
+
+    def solutions(self, timeout=None):
         """Generates the furthest left, and furthest right possible permutation of a row
         and takes the intersection of the points that are the same (line-solving).
         If no more points can be deduced, then it takes a random guess and repeats.
-        If the grid becomes invalid, it just backtracks to the last guess."""
+        If the grid becomes invalid, it just backtracks to the last guess.
+        Each solution is yielded as it is found, then it backtracks to the last guess
+        to look for the next one, until every guess has been tried.
+        Raises SolveTimeoutError if it takes longer than `timeout` seconds."""
         line_solve = self.line_solve
-        while len(self.solved_lines) < self.no_of_lines:
-            self.grid_changed = False
-
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            if deadline is not None and monotonic() > deadline:
+                raise SolveTimeoutError('Timed out')
             try:
                 line_solve()
+                if len(self.solved_lines) < self.no_of_lines:
+                    # Guesses if no extra blocks/gaps can be deduced
+                    self.guess()
+                    continue
             except InvalidGridError:
-                # Resets the grid back to the old state.
-                old_grid, old_guess, guess_pos, old_solved_lines = self.prev_states.pop()
-                self.grid = [l[:] for l in old_grid]
-                self.grid[guess_pos[0]][guess_pos[1]] = old_guess ^ 1  # Swaps the guess
-                self.solved_lines = old_solved_lines.copy()
-                continue
+                self.backtracks += 1
+                if self.learn:
+                    self.add_contradiction(self.get_guesses())
+            else:
+                yield self.get_grid()
+                # The other value of the last guess is no longer implied by the guesses
+                # before it, so the contradictions found from now on would be wrong.
+                self.learn = False
 
-            if not self.grid_changed and len(self.solved_lines) < self.no_of_lines:
-                # Guesses if no extra blocks/gaps have been deduced
-                self.guess()
-        return self.grid
+            if not self.prev_states:
+                # Every guess has been tried
+                return
+            # Resets the grid back to the old state.
+            trail_len, solved_len, old_guess, guess_pos = self.prev_states.pop()
+            self.undo(trail_len, solved_len)
+            # The old state was fully line solved, so only the swapped guess is queued.
+            self.queue.clear()
+            self.queued.clear()
+            self.set_square(*guess_pos, old_guess ^ 1)  # Swaps the guess
 
     def line_solve(self):
-        """This method should line solve all the clues in self.line_solve
+        """This method should line solve all the lines in self.queue until it is empty,
         using the furthest left, and furthest right to compare which blocks are valid/invalid.
         It may miss a small amount though (limitations of alg), but 'should' be fast(ish)"""
         solved_lines = self.solved_lines
+        lengths = self.lengths
+        clues = self.clues
+        queue = self.queue
+        queued = self.queued
+        linesolve_helper = getattr(self, self.ENGINES[self.engine])
         get_line = self.get_line
-        linesolve_helper = self.linesolve_helper
+        is_solved = self.is_solved
         change_grid = self.change_grid
 
-        for vert, pos, clue in self.to_linesolve:
+        while queue:
+            *_, vert, pos = heappop(queue)
+
+            if (vert, pos) not in queued:
+                # A stale entry for a line that has already been line solved
+                continue
+            queued.remove((vert, pos))
 
-            if (vert, pos, clue) in solved_lines:
+            if (vert, pos) in solved_lines:
                 # If the line is already solved
                 continue
 
-            line = get_line(vert, pos)  # The current line so far
+            line = get_line(vert, pos)
 
-            solved = linesolve_helper(line, clue)
+            self.line_solves += 1
+            new_line = linesolve_helper(clues[vert][pos], lengths[vert], *line)
 
-            if solved is True:
+            if is_solved(vert, new_line):
                 # The line must be solved
-                solved_lines.add((vert, pos, clue))
-            elif solved:
-                # Changes the grid if the line changed
-                change_grid(solved, vert, pos)
-                self.grid_changed = True
+                solved_lines.add((vert, pos))
+                if self.prev_states:
+                    self.solved_trail.append((vert, pos))
+            if new_line != line:
+                # Changes the grid if the line changed. The line itself is queued
+                # again as the new squares may lead to more deductions.
+                change_grid(vert, pos, *new_line)
+                if (vert, pos) not in solved_lines:
+                    self.queue_line(vert, pos)
+
+    def get_line(self, vert, pos):
+        """Returns the (filled, empty) bitmasks of the line."""
+        return self.filled[vert][pos], self.empty[vert][pos]
+
+    def is_solved(self, vert, line):
+        filled, empty = line
+        return filled | empty == (1 << self.lengths[vert]) - 1
+
+    def get_unknown(self, vert, pos):
+        """Returns a bitmask of the squares in the line that are still unknown."""
+        known = self.filled[vert][pos] | self.empty[vert][pos]
+        return ((1 << self.lengths[vert]) - 1) & ~known
 
     def guess(self):
         """Guesses a random choice if nothing can be deduced from linesolving"""
-        target = self.find_guess_target()
-        guess = 1
+        if self.branching == 'probe':
+            target, guess = self.probe_squares()
+            if target is None:
+                # Squares were deduced by probing, so there's no need to guess
+                return
+        else:
+            if self.branching == 'constrained':
+                target = self.find_constrained_targets()[0]
+            else:
+                target = self.find_guess_target()
+            guess = self.guess_value(target)
+
+        if self.learn and self.is_contradiction(target, guess):
+            if self.is_contradiction(target, guess ^ 1):
+                raise InvalidGridError('Invalid grid')
+            # The guess is already known to be wrong, so the square must be the other value
+            self.set_square(*target, guess ^ 1)
+            return
 
         # Incase the guess is wrong and needs to backtrack
-        self.prev_states.append(
-            ([l[:] for l in self.grid], guess, target, self.solved_lines.copy())
-        )
-        self.grid[target[0]][target[1]] = guess
+        self.prev_states.append((len(self.trail), len(self.solved_trail), guess, target))
+        self.set_square(*target, guess)
+        self.guesses += 1
+
+    def probe_squares(self):
+        """Tries both values of each of the most constrained squares. Returns the square
+        to guess and its value, or (None, None) if any squares could be deduced instead.
+        Raises InvalidGridError if both values of a square make the grid invalid."""
+        best = None
+        for target in self.find_constrained_targets()[: self.PROBE_LIMIT]:
+            val = self.guess_value(target)
+            changes = self.probe(target, val)
+            other_changes = self.probe(target, val ^ 1)
+            if changes is None and other_changes is None:
+                raise InvalidGridError('Invalid grid')
+            if changes is None or other_changes is None:
+                self.set_square(*target, val ^ 1 if changes is None else val)
+                return None, None
+
+            same = set(changes) & set(other_changes)
+            if same:
+                for square in same:
+                    self.set_square(*square)
+                return None, None
+
+            # The best square to guess is the one where both values deduce the most
+            score = min(len(changes), len(other_changes))
+            if best is None or score > best[0]:
+                best = score, target, val if len(changes) >= len(other_changes) else val ^ 1
+        return best[1], best[2]
+
+    def probe(self, target, val):
+        """Sets the square to `val` then line solves. Returns a list of the squares
+        (y, x, val) that were set, or None if the grid became invalid.
+        The grid is put back the way it was afterwards."""
+        if self.learn and self.is_contradiction(target, val):
+            return None
+
+        self.prev_states.append((len(self.trail), len(self.solved_trail), val, target))
+        self.set_square(*target, val)
+        try:
+            self.line_solve()
+            changes = self.get_changes(self.prev_states[-1][0])
+        except InvalidGridError:
+            changes = None
+            if self.learn:
+                self.add_contradiction(self.get_guesses())
+
+        trail_len, solved_len, _, _ = self.prev_states.pop()
+        self.undo(trail_len, solved_len)
+        self.queue.clear()
+        self.queued.clear()
+        return changes
+
+    def guess_value(self, target):
+        """The value to guess first at `target`"""
+        return 1
+
+    def get_changes(self, trail_len):
+        """Returns the squares (y, x, val) set since the trail was `trail_len` long."""
+        return self.trail[trail_len:]
+
+    def get_guesses(self):
+        """Returns the set of the guesses currently made, as ((y, x), val)"""
+        return frozenset((target, guess) for _, _, guess, target in self.prev_states)
+
+    def add_contradiction(self, guesses):
+        for guess in guesses:
+            self.contradictions.setdefault(guess, []).append(guesses)
+
+    def is_contradiction(self, target, val):
+        """Whether guessing `val` at `target`, along with the current guesses,
+        is already known to make the grid invalid."""
+        known = self.contradictions.get((target, val))
+        if not known:
+            return False
+        guesses = self.get_guesses() | {(target, val)}
+        return any(contradiction <= guesses for contradiction in known)
+
+    def find_constrained_targets(self):
+        """Returns the unknown squares sorted by the number of unknown squares
+        in their row and column, the most constrained first."""
+        unknowns = {
+            vert: [self.get_unknown(vert, pos) for pos in range(len(self.clues[vert]))]
+            for vert in 'RC'
+        }
+        counts = {vert: [bin(u).count('1') for u in unknowns[vert]] for vert in 'RC'}
+
+        targets = []
+        for y, unknown in enumerate(unknowns['R']):
+            while unknown:
+                low = unknown & -unknown
+                x = low.bit_length() - 1
+                targets.append((counts['R'][y] + counts['C'][x], (y, x)))
+                unknown ^= low
+        targets.sort()
+        return [target for _, target in targets]
 
     def find_guess_target(self):
         """Finds the first unknown square sorted by the length of the sum of the clue,
         and therefore should be more likely to lead to a guess with more impact"""
         for vert, pos, clue in self.to_linesolve:
-            if (vert, pos, clue) not in self.solved_lines:
-                if vert == 'R':
-                    for i, b in enumerate(self.grid[pos]):
-                        if b == -1:
-                            return (pos, i)
-                elif vert == 'C':
-                    for i, r in enumerate(self.grid):
-                        if r[pos] == -1:
-                            return i, pos
+            if (vert, pos) not in self.solved_lines:
+                unknown = self.get_unknown(vert, pos)
+                if unknown:
+                    i = (unknown & -unknown).bit_length() - 1
+                    return (pos, i) if vert == 'R' else (i, pos)
 
-    def get_line(self, vert, pos):
-        """Gets the specified line"""
-        if vert == 'R':
-            return tuple(self.grid[pos])
-        elif vert == 'C':
-            return tuple(row[pos] for row in self.grid)
-
-    def change_grid(self, line, vert, pos):
-        """Changes the line in the grid"""
-        if vert == 'R':
-            self.grid[pos] = list(line)
-        elif vert == 'C':
-            for i, val in enumerate(line):
-                self.grid[i][pos] = val
+    def get_grid(self):
+        """Returns the grid as a list of rows, using -1 for squares that are still unknown."""
+        return [
+            [1 if filled >> x & 1 else 0 if empty >> x & 1 else -1 for x in range(self.W)]
+            for filled, empty in zip(self.filled['R'], self.empty['R'])
+        ]
+
+    def set_square(self, y, x, val):
+        """Sets the square at row `y` and column `x` to `val` in both its row and column."""
+        masks = self.filled if val == 1 else self.empty
+        masks['R'][y] |= 1 << x
+        masks['C'][x] |= 1 << y
+        if self.prev_states:
+            self.trail.append((y, x, val))
+        self.queue_line('R', y)
+        self.queue_line('C', x)
+
+    def queue_line(self, vert, pos):
+        """Adds the line to the queue of lines to be line solved. If it is already
+        queued, it is pushed again with its new (lower) priority."""
+        unknown = bin(self.get_unknown(vert, pos)).count('1')
+        heappush(self.queue, (unknown, -self.clue_sums[vert][pos], vert, pos))
+        self.queued.add((vert, pos))
+
+    def change_grid(self, vert, pos, new_filled, new_empty):
+        """Changes the line in the grid. Only the squares that have changed
+        are copied over to the lines that cross it, and those lines are queued."""
+        cross = 'C' if vert == 'R' else 'R'
+        bit = 1 << pos
+        trail = self.trail if self.prev_states else None
+        for val, masks, new in ((1, self.filled, new_filled), (0, self.empty, new_empty)):
+            lines = masks[cross]
+            diff = new & ~masks[vert][pos]
+            masks[vert][pos] = new
+            while diff:
+                low = diff & -diff
+                i = low.bit_length() - 1
+                lines[i] |= bit
+                self.queue_line(cross, i)
+                if trail is not None:
+                    trail.append((pos, i, val) if vert == 'R' else (i, pos, val))
+                diff ^= low
+
+    def undo(self, trail_len, solved_len):
+        """Unsets every square on the trail after `trail_len`, and unsolves every line
+        on the solved trail after `solved_len`."""
+        trail = self.trail
+        rows_filled, cols_filled = self.filled['R'], self.filled['C']
+        rows_empty, cols_empty = self.empty['R'], self.empty['C']
+        while len(trail) > trail_len:
+            y, x, val = trail.pop()
+            rows, cols = (rows_filled, cols_filled) if val == 1 else (rows_empty, cols_empty)
+            rows[y] &= ~(1 << x)
+            cols[x] &= ~(1 << y)
+
+        solved_trail = self.solved_trail
+        while len(solved_trail) > solved_len:
+            self.solved_lines.remove(solved_trail.pop())
 
     @staticmethod
-    @Memo
-    def linesolve_helper(line, clue):
+    @LINE_CACHE
+    def linesolve_helper(clue, length, filled, empty):
         """This method first calculates the leftmost and
         rightmost possible permutations of the line.
-        Then it find the intersection where there is a overlap of the same colour."""
-        length = len(line)
+        Then it find the intersection where there is a overlap of the same colour.
+        Returns the new `filled` and `empty` bitmasks of the line."""
+        full = (1 << length) - 1
+        if not clue:
+            if filled:
+                raise InvalidGridError('Invalid grid')
+            return 0, full
 
-        leftmost = Nonogram.get_leftmost(clue, length, line)
-        rightmost = Nonogram.get_leftmost(clue[::-1], length, line[::-1])[::-1]
+        leftmost = Nonogram.get_leftmost(clue, length, filled, empty)
+        rightmost = Nonogram.get_leftmost(
+            clue[::-1], length, reverse_bits(filled, length), reverse_bits(empty, length)
+        )
+        if leftmost is None or rightmost is None:
+            raise InvalidGridError('Invalid grid')
+        # Converts the starts of the reversed blocks back to starts in the original line
+        rightmost = [length - start - block for start, block in zip(rightmost[::-1], clue)]
+
+        return Nonogram.find_intersection(leftmost, rightmost, clue, filled, empty, full)
+
+    @staticmethod
+    @LINE_CACHE
+    def get_leftmost(clue, length, filled, empty):
+        """This method should get the leftmost valid arrangement of all the clues.
+        Returns a tuple of the start position of each block, or None if
+        the blocks can't be arranged to fit the line."""
+        no_of_blocks = len(clue)
+        starts = []
+        failed = set()  # (block, pos) pairs that have no valid arrangement
 
-        solved = Nonogram.find_intersection(leftmost, rightmost, line, length)
+        def place(i, pos):
+            # Places block `i` at the first valid position at or after `pos`,
+            # then places the rest of the blocks after it.
+            if i == no_of_blocks:
+                # No filled squares can be left uncovered after the last block.
+                return not filled >> pos
+            if (i, pos) in failed:
+                return False
 
-        return solved if solved != line else not -1 in line
+            block = clue[i]
+            mask = (1 << block) - 1
+            start = pos
+            while start + block <= length:
+                blocked = empty >> start & mask
+                if blocked:
+                    # Jumps the block past the last empty square it is covering,
+                    # as long as that doesn't leave a filled square behind it.
+                    end = start + blocked.bit_length()
+                    if filled >> start & ((1 << (end - start)) - 1):
+                        break
+                    start = end
+                    continue
+
+                if not filled >> (start + block) & 1:
+                    # The square after the block is not filled, so the block fits here.
+                    starts.append(start)
+                    if place(i + 1, start + block + 1):
+                        return True
+                    starts.pop()
+
+                if filled >> start & 1:
+                    # Moving the block along would leave a filled square uncovered.
+                    break
+                start += 1
+
+            failed.add((i, pos))
+            return False
+
+        return tuple(starts) if place(0, 0) else None
 
     @staticmethod
-    @Memo
-    def get_leftmost(clue, length, filled_line):
-        """This method should get the leftmost valid arrangement of all the clues."""
-
-        # List of all blocks in order of clues given.
-        # block is [start_pos, end_pos, length]
-        blocks = tuple([0, c, c] for c in clue)
-
-        for i, block in enumerate(blocks):
-            # Moves the blocks up until they are all in valid positions,
-            # but not necessarily covering all the blocked spots.
-            if i != 0:
-                # Teleports the block to the end of the previous block
-                diff = blocks[i - 1][1] - block[0] + 1
-                block[0] += diff
-                block[1] += diff
-
-            while 0 in filled_line[block[0] : block[1]]:
-                # If the block is in an invalid position, then it moves it along 1 square
-                block[0] += 1
-                block[1] += 1
+    @LINE_CACHE
+    def linesolve_dp(clue, length, filled, empty):
+        """Finds every square of the line that is the same in all the valid arrangements.
+        `fwd[j][i]` is whether the first `j` blocks fit in the first `i` squares,
+        and `bwd[j][i]` is whether the blocks from `j` onwards fit in the squares from `i`
+        onwards. A square can be empty if it lies in a gap between two halves that fit,
+        and can be filled if a block that has valid halves on both sides covers it.
+        Returns the new `filled` and `empty` bitmasks of the line."""
+        no_of_blocks = len(clue)
+        can_fill = [not empty >> i & 1 for i in range(length)]
+        can_empty = [not filled >> i & 1 for i in range(length)]
 
-        while True:
-            # Moves the blocks until all the blocked spots are covered.
-
-            line = [0] * length
-            # Fills in the line if a block is there.
-            for block in blocks:
-                line[block[0] : block[1]] = [1] * block[2]
-
-            changed = False
-            for i, c in enumerate(filled_line):
-                # If a block should be covering a filled square but isn't
-                if c == 1 and line[i] == 0:
-                    changed = True
-                    for block in reversed(blocks):
-                        # Finds the first block to the left of the square,
-                        # and teleports the right end of the block to the square
-                        if block[1] <= i:
-                            diff = i - block[1] + 1
-                            block[0] += diff
-                            block[1] += diff
-                            break
-                    else:
-                        # If no block was found, then the grid must be invalid.
-                        raise InvalidGridError('Invalid grid')
-
-            if not changed:
-                break
-
-            for i, block in enumerate(blocks):
-                # Moves the blocks up until they are not covering any zeros,
-                # but not necessarily covering all the blocked spots,
-                while 0 in filled_line[block[0] : block[1]]:
-                    # If the block is in an invalid spot
-                    block[0] += 1
-                    block[1] += 1
-
-                if i != 0:
-                    # If any block is in an invalid position compared to the previous block
-                    if block[0] <= blocks[i - 1][1]:
-                        # Teleports the block to 1 square past the end of the previous block
-                        diff = blocks[i - 1][1] - block[0] + 1
-                        block[0] += diff
-                        block[1] += diff
-
-        return tuple(line)
+        # The number of squares that can be filled in a row, ending at / starting from `i`
+        run_to = [0] * (length + 1)
+        for i in range(length):
+            run_to[i + 1] = run_to[i] + 1 if can_fill[i] else 0
+        run_from = [0] * (length + 1)
+        for i in reversed(range(length)):
+            run_from[i] = run_from[i + 1] + 1 if can_fill[i] else 0
+
+        fwd = [[False] * (length + 1) for _ in range(no_of_blocks + 1)]
+        fwd[0][0] = True
+        for i in range(length):
+            fwd[0][i + 1] = fwd[0][i] and can_empty[i]
+        for j in range(1, no_of_blocks + 1):
+            block = clue[j - 1]
+            row, prev = fwd[j], fwd[j - 1]
+            for i in range(block, length + 1):
+                if row[i - 1] and can_empty[i - 1]:
+                    row[i] = True
+                elif run_to[i] >= block:
+                    # Block `j - 1` ends just before square `i`
+                    start = i - block
+                    row[i] = (
+                        prev[start]
+                        if j == 1
+                        else start > 0 and can_empty[start - 1] and prev[start - 1]
+                    )
+
+        bwd = [[False] * (length + 2) for _ in range(no_of_blocks + 1)]
+        bwd[no_of_blocks][length] = True
+        for i in reversed(range(length)):
+            bwd[no_of_blocks][i] = bwd[no_of_blocks][i + 1] and can_empty[i]
+        for j in reversed(range(no_of_blocks)):
+            block = clue[j]
+            row, nxt = bwd[j], bwd[j + 1]
+            for i in reversed(range(length - block + 1)):
+                if row[i + 1] and can_empty[i]:
+                    row[i] = True
+                elif run_from[i] >= block:
+                    # Block `j` starts at square `i`
+                    end = i + block
+                    row[i] = (
+                        nxt[end]
+                        if j == no_of_blocks - 1
+                        else end < length and can_empty[end] and nxt[end + 1]
+                    )
+
+        if not bwd[0][0]:
+            raise InvalidGridError('Invalid grid')
+
+        for i in range(length):
+            if can_empty[i] and not any(
+                fwd[j][i] and bwd[j][i + 1] for j in range(no_of_blocks + 1)
+            ):
+                filled |= 1 << i
+
+        # How many valid block positions cover each square, as a difference array
+        covered = [0] * (length + 1)
+        for j, block in enumerate(clue):
+            last = j == no_of_blocks - 1
+            for start in range(length - block + 1):
+                end = start + block
+                if (
+                    run_from[start] >= block
+                    and (
+                        fwd[0][start]
+                        if j == 0
+                        else start > 0 and can_empty[start - 1] and fwd[j][start - 1]
+                    )
+                    and (
+                        bwd[no_of_blocks][end]
+                        if last
+                        else end < length and can_empty[end] and bwd[j + 1][end + 1]
+                    )
+                ):
+                    covered[start] += 1
+                    covered[end] -= 1
+
+        cover = 0
+        for i in range(length):
+            cover += covered[i]
+            if not cover:
+                empty |= 1 << i
+
+        return filled, empty
 
     @staticmethod
-    def find_intersection(left, right, line, length):
-        """Groups the same blocks together then takes the intersection."""
-        leftmost = list(
-            chain.from_iterable(
-                [i] * len(list(g[1])) for i, g in enumerate(groupby((0,) + left))
-            )
-        )[1:]
-        rightmost = list(
-            chain.from_iterable(
-                [i] * len(list(g[1])) for i, g in enumerate(groupby((0,) + right))
+    def find_intersection(left, right, clue, filled, empty, full):
+        """Takes the intersection of the leftmost and rightmost arrangements.
+        The squares covered by the same block in both are filled, and the squares
+        in the same gap between blocks in both are empty."""
+        prev_end = 0  # The end of the previous block in the rightmost arrangement
+        for left_start, right_start, block in zip(left, right, clue):
+            # The gap before this block
+            empty |= ((1 << left_start) - 1) & ~((1 << prev_end) - 1)
+            if right_start < left_start + block:
+                filled |= ((1 << (left_start + block - right_start)) - 1) << right_start
+            prev_end = right_start + block
+        empty |= full & ~((1 << prev_end) - 1)
+
+        return filled, empty
+
+
+class ColourNonogram(Nonogram):
+    """A nonogram with any number of colours. Each clue is a tuple of (length, colour)
+    pairs, where the colours can be any hashable labels. Blocks of the same colour need
+    at least one background square between them, but blocks of different colours can touch.
+
+    Every line is stored as one bitmask per colour, with a bit set for each square
+    that can still be that colour. Colour 0 is the background, and the colours in the
+    clues are numbered from 1. So each square holds the set of colours it can still be,
+    and line solving only ever removes colours from squares.
+
+    Guesses are encoded as `2 * colour + 1` for "the square is `colour`", and
+    `2 * colour` for "the square is not `colour`", so `guess ^ 1` is the other value
+    of a guess, just like in `Nonogram`. Entries on the trail are (y, x, old colours)."""
+
+    ENGINES = {'dp': 'linesolve_colour'}
+
+    __slots__ = ['colours', 'background', 'possible']
+
+    def __init__(
+        self,
+        clues,
+        width,
+        height,
+        background=0,
+        engine='dp',
+        branching='first',
+        learn=False,
+    ):
+        self.background = background
+        self.colours = [background]
+        numbers = {}
+        for line_clues in clues:
+            for clue in line_clues:
+                for _, colour in clue:
+                    if colour not in numbers:
+                        numbers[colour] = len(self.colours)
+                        self.colours.append(colour)
+
+        clues = tuple(
+            tuple(
+                tuple((length, numbers[colour]) for length, colour in clue)
+                for clue in line_clues
             )
-        )[1:]
-
-        solved = tuple(
-            line[i]
-            if line[i] != -1
-            else -1
-            if leftmost[i] != rightmost[i]
-            else leftmost[i] % 2
-            for i in range(length)
+            for line_clues in clues
         )
+        super().__init__(clues, width, height, engine, branching, learn)
+
+    def init_grid(self):
+        no_of_colours = len(self.colours)
+        self.possible = {
+            'R': [[(1 << self.W) - 1] * no_of_colours for _ in range(self.H)],
+            'C': [[(1 << self.H) - 1] * no_of_colours for _ in range(self.W)],
+        }
+
+    @staticmethod
+    def clue_sum(clue):
+        return sum(length for length, _ in clue)
+
+    def get_line(self, vert, pos):
+        return tuple(self.possible[vert][pos])
+
+    def is_solved(self, vert, line):
+        return not self.multiple_colours(line)
+
+    def get_unknown(self, vert, pos):
+        return self.multiple_colours(self.possible[vert][pos])
+
+    @staticmethod
+    def multiple_colours(masks):
+        """Returns a bitmask of the squares that can be more than one colour."""
+        seen = multiple = 0
+        for mask in masks:
+            multiple |= seen & mask
+            seen |= mask
+        return multiple
+
+    def get_colours(self, y, x):
+        """Returns the set of colours the square can be, as a bitmask of colour numbers."""
+        return sum(1 << c for c, mask in enumerate(self.possible['R'][y]) if mask >> x & 1)
+
+    def guess_value(self, target):
+        """Guesses the first colour (other than the background) the square can be."""
+        colours = self.get_colours(*target)
+        colour = ((colours >> 1) & -(colours >> 1)).bit_length()
+        return 2 * colour + 1
+
+    def get_changes(self, trail_len):
+        """Returns (y, x, 2 * colour) for each colour removed from a square
+        since the trail was `trail_len` long."""
+        old_colours = {}
+        for y, x, colours in self.trail[trail_len:]:
+            old_colours.setdefault((y, x), colours)
+
+        changes = []
+        for (y, x), colours in old_colours.items():
+            removed = colours & ~self.get_colours(y, x)
+            changes.extend(
+                (y, x, 2 * c) for c in range(len(self.colours)) if removed >> c & 1
+            )
+        return changes
+
+    def get_grid(self):
+        """Returns the grid as a list of rows of colours, using -1 for squares
+        that could still be more than one colour."""
+        grid = []
+        for y in range(self.H):
+            row = []
+            for x in range(self.W):
+                colours = self.get_colours(y, x)
+                single = colours & (colours - 1) == 0
+                row.append(self.colours[colours.bit_length() - 1] if single else -1)
+            grid.append(row)
+        return grid
+
+    def set_square(self, y, x, val):
+        """Makes the square `colour` if `val` is odd, or removes `colour` from it if `val`
+        is even, where `colour = val // 2`."""
+        colour = val >> 1
+        old = self.get_colours(y, x)
+        new = old & (1 << colour) if val & 1 else old & ~(1 << colour)
+        self.set_colours(y, x, new)
+        if self.prev_states:
+            self.trail.append((y, x, old))
+        self.queue_line('R', y)
+        self.queue_line('C', x)
+
+    def set_colours(self, y, x, colours):
+        row, col = self.possible['R'][y], self.possible['C'][x]
+        for c in range(len(row)):
+            if colours >> c & 1:
+                row[c] |= 1 << x
+                col[c] |= 1 << y
+            else:
+                row[c] &= ~(1 << x)
+                col[c] &= ~(1 << y)
+
+    def change_grid(self, vert, pos, *new_line):
+        """Changes the line in the grid. Only the squares that have changed
+        are copied over to the lines that cross it, and those lines are queued."""
+        cross = 'C' if vert == 'R' else 'R'
+        bit = 1 << pos
+        line = self.possible[vert][pos]
+        lines = self.possible[cross]
+
+        changed = 0
+        for old, new in zip(line, new_line):
+            changed |= old & ~new
 
-        return solved
+        trail = self.trail if self.prev_states else None
+        while changed:
+            low = changed & -changed
+            i = low.bit_length() - 1
+            if trail is not None:
+                old = sum(1 << c for c, mask in enumerate(line) if mask & low)
+                trail.append((pos, i, old) if vert == 'R' else (i, pos, old))
+            cross_line = lines[i]
+            for c, new in enumerate(new_line):
+                if not new & low:
+                    cross_line[c] &= ~bit
+            self.queue_line(cross, i)
+            changed ^= low
+
+        line[:] = new_line
+
+    def undo(self, trail_len, solved_len):
+        """Puts back the old colours of every square on the trail after `trail_len`,
+        and unsolves every line on the solved trail after `solved_len`."""
+        trail = self.trail
+        while len(trail) > trail_len:
+            y, x, colours = trail.pop()
+            self.set_colours(y, x, colours)
+
+        solved_trail = self.solved_trail
+        while len(solved_trail) > solved_len:
+            self.solved_lines.remove(solved_trail.pop())
+
+    @staticmethod
+    @LINE_CACHE
+    def linesolve_colour(clue, length, *possible):
+        """The same dynamic program as `Nonogram.linesolve_dp`, but with colours.
+        `possible[c]` has a bit set for each square that can still be colour `c`.
+        A block can only go where every square can be its colour, and it needs
+        a background square before it if the block before is the same colour.
+        Returns the new `possible` bitmasks of the line."""
+        no_of_blocks = len(clue)
+        can_empty = [possible[0] >> i & 1 for i in range(length)]
+        # Whether block `j` needs a gap between it and the block before
+        needs_gap = [j > 0 and clue[j - 1][1] == clue[j][1] for j in range(no_of_blocks)]
+
+        # The number of squares that can be each colour in a row,
+        # ending at / starting from `i`
+        run_to = {}
+        run_from = {}
+        for _, colour in clue:
+            if colour in run_to:
+                continue
+            mask = possible[colour]
+            to = run_to[colour] = [0] * (length + 1)
+            for i in range(length):
+                to[i + 1] = to[i] + 1 if mask >> i & 1 else 0
+            fr = run_from[colour] = [0] * (length + 1)
+            for i in reversed(range(length)):
+                fr[i] = fr[i + 1] + 1 if mask >> i & 1 else 0
+
+        fwd = [[False] * (length + 1) for _ in range(no_of_blocks + 1)]
+        fwd[0][0] = True
+        for i in range(length):
+            fwd[0][i + 1] = fwd[0][i] and can_empty[i]
+        for j in range(1, no_of_blocks + 1):
+            block, colour = clue[j - 1]
+            row, prev, to = fwd[j], fwd[j - 1], run_to[colour]
+            for i in range(block, length + 1):
+                if row[i - 1] and can_empty[i - 1]:
+                    row[i] = True
+                elif to[i] >= block:
+                    # Block `j - 1` ends just before square `i`
+                    start = i - block
+                    row[i] = (
+                        start > 0 and can_empty[start - 1] and prev[start - 1]
+                        if needs_gap[j - 1]
+                        else prev[start]
+                    )
+
+        bwd = [[False] * (length + 2) for _ in range(no_of_blocks + 1)]
+        bwd[no_of_blocks][length] = True
+        for i in reversed(range(length)):
+            bwd[no_of_blocks][i] = bwd[no_of_blocks][i + 1] and can_empty[i]
+        for j in reversed(range(no_of_blocks)):
+            block, colour = clue[j]
+            row, nxt, fr = bwd[j], bwd[j + 1], run_from[colour]
+            gap_after = j + 1 < no_of_blocks and needs_gap[j + 1]
+            for i in reversed(range(length - block + 1)):
+                if row[i + 1] and can_empty[i]:
+                    row[i] = True
+                elif fr[i] >= block:
+                    # Block `j` starts at square `i`
+                    end = i + block
+                    row[i] = (
+                        end < length and can_empty[end] and nxt[end + 1]
+                        if gap_after
+                        else nxt[end]
+                    )
+
+        if not bwd[0][0]:
+            raise InvalidGridError('Invalid grid')
+
+        new_possible = [0] * len(possible)
+        for i in range(length):
+            if can_empty[i] and any(
+                fwd[j][i] and bwd[j][i + 1] for j in range(no_of_blocks + 1)
+            ):
+                new_possible[0] |= 1 << i
+
+        # How many valid block positions of each colour cover each square,
+        # as difference arrays
+        covered = {colour: [0] * (length + 1) for colour in run_to}
+        for j, (block, colour) in enumerate(clue):
+            gap_after = j + 1 < no_of_blocks and needs_gap[j + 1]
+            fr = run_from[colour]
+            cover = covered[colour]
+            for start in range(length - block + 1):
+                end = start + block
+                if (
+                    fr[start] >= block
+                    and (
+                        start > 0 and can_empty[start - 1] and fwd[j][start - 1]
+                        if needs_gap[j]
+                        else fwd[j][start]
+                    )
+                    and (
+                        end < length and can_empty[end] and bwd[j + 1][end + 1]
+                        if gap_after
+                        else bwd[j + 1][end]
+                    )
+                ):
+                    cover[start] += 1
+                    cover[end] -= 1
+
+        for colour, cover in covered.items():
+            count = 0
+            mask = 0
+            for i in range(length):
+                count += cover[i]
+                if count:
+                    mask |= 1 << i
+            new_possible[colour] = mask
+
+        return tuple(new_possible)
 
 
 class InvalidGridError(Exception):
     """Custom Exception for an invalid grid."""
 
 
+class SolveTimeoutError(Exception):
+    """Custom Exception for when solving takes longer than the timeout."""
+
+
 if __name__ == '__main__':
     clues = (
         (
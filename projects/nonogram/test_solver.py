@@ -0,0 +1,40 @@
+import pytest
+
+import solver
+
+
+@pytest.fixture
+def compact_cache():
+    cache = solver.LINE_CACHE
+    cache.compact = True
+    cache.clear()
+    yield cache
+    cache.compact = False
+    cache.clear()
+
+
+def test_compact_keys_differ_by_number_of_colours(compact_cache):
+    linesolve_colour = solver.ColourNonogram.linesolve_colour
+    # Four bitmasks, where only colour 1 is possible
+    assert linesolve_colour(((1, 1),), 1, 0, 1, 0, 0) == (0, 1, 0, 0)
+    # Three bitmasks which pack into the same bits, where colour 1 isn't possible
+    with pytest.raises(solver.InvalidGridError):
+        linesolve_colour(((1, 1),), 1, 1, 0, 0)
+
+
+def test_compact_cache_solves_mixed_puzzles(compact_cache):
+    one_colour = ((((1, 'r'),), ()), (((1, 'r'),),))
+    two_colours = ((((1, 'r'),), ((1, 'b'),)), (((1, 'r'), (1, 'b')),))
+    for _ in range(2):
+        assert solver.solve_colour(one_colour, 2, 1, background='.') == (('r', '.'),)
+        assert solver.solve_colour(two_colours, 2, 1, background='.') == (('r', 'b'),)
+
+
+def test_solve_batch_carries_on_after_an_unsolvable_puzzle():
+    good = (((1,), ()), ((1,),)), 2, 1
+    bad = (((1,), (1,)), ((),)), 2, 1
+    assert dict(solver.solve_batch([good, bad, good], processes=2)) == {
+        0: ((1, 0),),
+        1: None,
+        2: ((1, 0),),
+    }
@@ -0,0 +1,242 @@
+"""Optimal (or near optimal) sliding puzzle solving with IDA* and pattern databases.
+
+The tiles are split into disjoint groups, and for each group a pattern database holds the
+fewest moves of the group's tiles needed to get them from any positions to their correct
+positions. The blank is ignored, so only moves of the group's own tiles are counted, which
+means the databases of the groups can be added together and still never overestimate the
+moves left. That sum is the heuristic for an IDA* search.
+
+Each database is built once with a breadth first search backwards from the solved
+positions, then saved to `CACHE_DIR` as one byte per entry and memory mapped when needed.
+The index of an entry is `sum(position of the group's ith tile * cells ** i)`.
+
+Run this file to build every database ahead of time:
+
+    python optimal.py
+"""
+
+import mmap
+import os
+from itertools import count
+
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pattern_databases')
+
+# {size: the groups of tiles with a database each}
+GROUPS = {
+    3: ((1, 2, 4, 5), (3, 6, 7, 8)),
+    4: ((1, 2, 3, 5, 6), (4, 7, 8, 11, 12), (9, 10, 13, 14, 15)),
+    5: (
+        (1, 2, 6, 7), (3, 4, 8, 9), (5, 10, 15, 20),
+        (11, 12, 16, 17), (13, 14, 18, 19), (21, 22, 23, 24),
+    ),
+}
+
+# {size: the weight of the heuristic}. Above 1 the search is much faster, but the
+# solutions found can be longer than optimal. Optimal 5x5 solutions take far too long.
+WEIGHTS = {3: 1, 4: 1, 5: 2}
+
+UNVISITED = 255
+
+_databases = {}
+
+
+def is_solvable(grid):
+    """Returns whether the grid can be solved, using the parity of the inversions.
+    On odd widths, every move keeps the parity of the inversions the same. On even widths,
+    moving the blank up or down changes both the parity and the row of the blank, so the
+    parity of the inversions plus the blank's distance from the bottom row is kept.
+    The parity of the inversions is found from the cycles of the tiles' permutation,
+    so it only takes one pass over the grid. Empty grids, grids that aren't square,
+    and grids that aren't a permutation of 0 to size * size - 1 are never solvable."""
+    size = len(grid)
+    tiles = [sq - 1 for row in grid for sq in row if sq]
+    if not size or any(len(row) != size for row in grid):
+        return False
+    if sorted(tiles) != list(range(size * size - 1)):
+        return False
+
+    # Every cycle of length k is k - 1 swaps
+    parity = len(tiles)
+    seen = [False] * len(tiles)
+    for start in range(len(tiles)):
+        if not seen[start]:
+            parity -= 1
+            i = start
+            while not seen[i]:
+                seen[i] = True
+                i = tiles[i]
+
+    if size % 2:
+        return parity % 2 == 0
+    blank_row = next(y for y, row in enumerate(grid) if 0 in row)
+    return (parity + size - 1 - blank_row) % 2 == 0
+
+
+def get_adjacent(size):
+    """Returns a table of the cells next to each cell"""
+    adjacent = []
+    for cell in range(size * size):
+        y, x = divmod(cell, size)
+        adjacent.append(tuple(
+            ny * size + nx for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1))
+            if 0 <= ny < size and 0 <= nx < size
+        ))
+    return adjacent
+
+
+def build_database(size, group):
+    """Returns the pattern database of `group` as a bytearray"""
+    cells = size * size
+    adjacent = get_adjacent(size)
+    weights = [cells ** i for i in range(len(group))]
+
+    database = bytearray([UNVISITED]) * cells ** len(group)
+    start = sum((tile - 1) * weight for tile, weight in zip(group, weights))
+    database[start] = 0
+    frontier = [start]
+    for depth in count(1):
+        if not frontier:
+            break
+        new_frontier = []
+        for index in frontier:
+            positions = []
+            rest = index
+            for _ in group:
+                rest, position = divmod(rest, cells)
+                positions.append(position)
+            for position, weight in zip(positions, weights):
+                for new_position in adjacent[position]:
+                    if new_position in positions:
+                        continue
+                    new_index = index + (new_position - position) * weight
+                    if database[new_index] == UNVISITED:
+                        database[new_index] = depth
+                        new_frontier.append(new_index)
+        frontier = new_frontier
+    return database
+
+
+def get_database(size, group):
+    """Returns the pattern database of `group`, memory mapped from `CACHE_DIR`.
+    It is built and saved first if it hasn't been already."""
+    key = size, group
+    if key in _databases:
+        return _databases[key]
+
+    path = os.path.join(CACHE_DIR, f'{size}x{size}-{"-".join(map(str, group))}.bin')
+    if not os.path.exists(path):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        database = build_database(size, group)
+        # Written to a temporary file first, so a half written database is never loaded
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(database)
+        os.replace(temp_path, path)
+
+    with open(path, 'rb') as f:
+        database = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    _databases[key] = database
+    return database
+
+
+def solve_optimal(grid, weight=None):
+    """Returns the list of tiles to move to solve the grid, which is the shortest possible
+    if `weight` is 1. Defaults to `WEIGHTS` for the size of the grid."""
+    size = len(grid)
+    if size not in GROUPS:
+        raise ValueError(f'no pattern databases for a {size}x{size} grid')
+    if not is_solvable(grid):
+        raise ValueError('the grid is unsolvable')
+    return OptimalSolver(grid, WEIGHTS[size] if weight is None else weight).solve()
+
+
+class OptimalSolver:
+    """IDA* search over the position of the blank. The grid is held as a flat list, and
+    the database index of each group is updated as its tiles move, so the heuristic is
+    updated with just two lookups per move."""
+
+    def __init__(self, grid, weight=1):
+        size = len(grid)
+        cells = size * size
+        self.size = size
+        self.weight = weight
+        self.tiles = [sq for row in grid for sq in row]
+        self.blank = self.tiles.index(0)
+        self.adjacent = get_adjacent(size)
+
+        groups = GROUPS[size]
+        self.databases = [get_database(size, group) for group in groups]
+        # {tile: (its group, its weight in the index of the group)}
+        self.group_of = {}
+        for g, group in enumerate(groups):
+            for i, tile in enumerate(group):
+                self.group_of[tile] = g, cells ** i
+        self.indexes = [0] * len(groups)
+        for cell, tile in enumerate(self.tiles):
+            if tile:
+                g, tile_weight = self.group_of[tile]
+                self.indexes[g] += cell * tile_weight
+
+        self.moves = []
+        self.nodes = 0
+
+    def heuristic(self):
+        return sum(database[index] for database, index in zip(self.databases, self.indexes))
+
+    def solve(self):
+        bound = self.heuristic() * self.weight
+        while True:
+            bound = self.search(0, self.heuristic(), bound, None)
+            if bound is None:
+                return self.moves
+
+    def search(self, depth, h, bound, previous):
+        """Searches for a solution within `bound`. Returns None if it was found (with the
+        moves in `self.moves`), or else the smallest cost found over the bound."""
+        self.nodes += 1
+        cost = depth + h * self.weight
+        if cost > bound:
+            return cost
+        if h == 0:
+            return None
+
+        tiles = self.tiles
+        blank = self.blank
+        smallest = float('inf')
+        for cell in self.adjacent[blank]:
+            if cell == previous:
+                continue
+            tile = tiles[cell]
+            g, tile_weight = self.group_of[tile]
+            database = self.databases[g]
+            old_index = self.indexes[g]
+            new_index = old_index + (blank - cell) * tile_weight
+            new_h = h - database[old_index] + database[new_index]
+
+            tiles[blank], tiles[cell] = tile, 0
+            self.blank = cell
+            self.indexes[g] = new_index
+            self.moves.append(tile)
+
+            result = self.search(depth + 1, new_h, bound, blank)
+            if result is None:
+                return None
+            smallest = min(smallest, result)
+
+            self.moves.pop()
+            self.indexes[g] = old_index
+            self.blank = blank
+            tiles[blank], tiles[cell] = 0, tile
+        return smallest
+
+
+def main():
+    for size, groups in GROUPS.items():
+        for group in groups:
+            get_database(size, group)
+            print(f'Built the {size}x{size} database for {group}')
+
+
+if __name__ == '__main__':
+    main()
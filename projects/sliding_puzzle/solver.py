@@ -1,13 +1,63 @@
 from heapq import heappop, heappush
+from multiprocessing import Pool
 
+from optimal import GROUPS, is_solvable, solve_optimal
 
-def slide_puzzle(puzzle):
-    solver = SlidingSolver(puzzle)
-    try:
-        solver.solve()
-        return solver.moves
-    except Exception:
+
+# The (x, y) offsets of the squares around a square, in clockwise order
+RING = ((-1, -1), (0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0))
+
+
+def get_macros():
+    """Returns {(offset of the 0 square from a number, direction to move the number):
+    the ways to cycle the 0 square around the number until it is in that direction}.
+    Each way is the offsets that the 0 square passes through, with the shortest first."""
+    macros = {}
+    for i, offset in enumerate(RING):
+        for direction in RING[1::2]:
+            j = RING.index(direction)
+            clockwise = tuple(RING[(i + k) % 8] for k in range(1, (j - i) % 8 + 1))
+            anticlockwise = tuple(RING[(i - k) % 8] for k in range(1, (i - j) % 8 + 1))
+            macros[offset, direction] = tuple(
+                sorted({clockwise, anticlockwise}, key=len)
+            )
+    return macros
+
+
+MACROS = get_macros()
+
+
+def slide_puzzle(puzzle, optimal=False):
+    """Returns the list of numbers to move to solve the puzzle, or None if it is unsolvable.
+    If `optimal`, 3x3 to 5x5 puzzles are solved with far fewer moves (the fewest possible
+    below 5x5) by `optimal.solve_optimal`, which is much slower. Other sizes, or if
+    `optimal` is False, are solved border by border with `SlidingSolver`.
+    Unsolvable puzzles are found with `optimal.is_solvable` before any solving.
+    A 1x1 puzzle is already solved, and an empty puzzle is unsolvable."""
+    if not is_solvable(puzzle):
         return None
+    if len(puzzle) < 2:
+        return []
+    if optimal and len(puzzle) in GROUPS:
+        return solve_optimal(puzzle)
+
+    solver = SlidingSolver(puzzle)
+    solver.solve()
+    return solver.moves
+
+
+def solve_batch(puzzles, processes=None, optimal=False):
+    """Solves an iterable of puzzles across a pool of `processes` worker processes (all
+    the cores by default). Yields `(index, moves)` as soon as each puzzle is solved, so the
+    order is not the same as `puzzles`. `moves` is None if the puzzle is unsolvable."""
+    with Pool(processes) as pool:
+        tasks = ((i, puzzle, optimal) for i, puzzle in enumerate(puzzles))
+        yield from pool.imap_unordered(_solve_task, tasks)
+
+
+def _solve_task(task):
+    index, puzzle, optimal = task
+    return index, slide_puzzle(puzzle, optimal)
 
 
 class SlidingSolver:
@@ -33,18 +83,32 @@ class SlidingSolver:
             for x, sq in enumerate(row):
                 self.location_of[sq] = (x, y)
 
+        # The cells next to each cell, where the cell at (x, y) is `y * size + x`
+        self.neighbour_cells = []
+        for y in range(size):
+            for x in range(size):
+                self.neighbour_cells.append(tuple(
+                    (y + ny) * size + x + nx for nx, ny in self.neighbours
+                    if 0 <= x + nx < size and 0 <= y + ny < size
+                ))
+
         # Squares that are in the correct position and shouldn't be disturbed
         self.fixed = set()
+        # Whether each cell can be moved through, which is False for the cells of the
+        # fixed numbers. Only updated through `fix` and `unfix`.
+        self.passable = [True] * (size * size)
         self.current_border = 0
 
         self.moves = []
+        self.moves_saved = 0
 
     def solve(self):
         """The upmost and leftmost lines (borders) are solved.
         Then the next inner borders are solved. This is repeated
         until only a 2x2 grid remains unsolved. Then finally,
         the 2x2 grid is solved. `self.current_border` is the
-        current border to be solved."""
+        current border to be solved. Finally, moves that cancel
+        out are removed with `compress_moves`."""
 
         while self.current_border < self.size - 2:
             self.solve_border()
@@ -53,7 +117,22 @@ class SlidingSolver:
         size = self.size
         for num in ((size - 1) * size - 1, (size - 1) * size, size * size - 1):
             self.move_num_to_position(num, self.correct_pos_of[num])
-            self.fixed.add(num)
+            self.fix(num)
+
+        self.compress_moves()
+
+    def compress_moves(self):
+        """Removes the moves that cancel out from `self.moves`, setting `self.moves_saved`
+        to the amount removed. Moving the same number twice in a row just moves it back,
+        so both moves are removed, which can leave another pair like that to remove."""
+        moves = []
+        for num in self.moves:
+            if moves and moves[-1] == num:
+                moves.pop()
+            else:
+                moves.append(num)
+        self.moves_saved += len(self.moves) - len(moves)
+        self.moves = moves
 
     def solve_border(self):
         """The border of the grid is solved by solving the
@@ -70,7 +149,7 @@ class SlidingSolver:
         current_border = self.current_border
         correct_num_at = self.correct_num_at
         location_of = self.location_of
-        fixed = self.fixed
+        fix = self.fix
         move_num_to_position = self.move_num_to_position
 
         row_positions = [(i, current_border) for i in range(self.size)]
@@ -82,7 +161,7 @@ class SlidingSolver:
             num = correct_num_at[position]
             move_num_to_position(num, position)
 
-            fixed.add(num)
+            fix(num)
 
         # Now solve the last two pieces of the row and column
         for i, positions in enumerate((row_positions, column_positions)):
@@ -114,25 +193,24 @@ class SlidingSolver:
             move_num_to_position(last, before_last_pos, keep_fixed={l2st})
             # move 2nd last square to correct position
             move_num_to_position(l2st, positions[-2], keep_fixed={last})
-            fixed.add(l2st)
+            fix(l2st)
             # move last square to correct position
             move_num_to_position(last, positions[-1])
-            fixed.add(last)
+            fix(last)
 
     def find_path(self, start, end):
         """A* pathfinding. Uses Manhatten distance for the heuristic.
-        Returns the positions that the path took from `start` to `end`"""
+        Returns the positions that the path took from `start` to `end`.
+        The search is over cell indexes, using `self.passable` and `self.neighbour_cells`,
+        so it only costs as much as the cells it visits."""
 
-        grid = self.grid
-        neighbours = self.neighbours
-        fixed = self.fixed
-
-        squares = {}
-        for y, row in enumerate(grid):
-            for x, sq in enumerate(row):
-                squares[(x, y)] = sq not in fixed
+        size = self.size
+        passable = self.passable
+        neighbour_cells = self.neighbour_cells
 
+        start = start[1] * size + start[0]
         end_x, end_y = end
+        end = end_y * size + end_x
 
         inf = float("inf")
         open_ = [(0, 0, start)]  # [F cost, count, node]
@@ -142,23 +220,19 @@ class SlidingSolver:
 
         while open_:
             current = heappop(open_)[2]
-            cx, cy = current
             if current == end:
                 break
 
             current_dist = dists[current]
-            for nx, ny in neighbours:
-                new_pos = (cx + nx, cy + ny)
-                new_dist = current_dist + 1
-
-                if squares.get(new_pos, False) and new_dist < dists.get(new_pos, inf):
+            new_dist = current_dist + 1
+            for new_pos in neighbour_cells[current]:
+                if passable[new_pos] and new_dist < dists.get(new_pos, inf):
                     count -= 1
+                    new_y, new_x = divmod(new_pos, size)
                     heappush(
                         open_,
                         (
-                            current_dist
-                            + abs(end_x - new_pos[0])
-                            + abs(end_y - new_pos[1]),
+                            current_dist + abs(end_x - new_x) + abs(end_y - new_y),
                             count,
                             new_pos,
                         ),
@@ -172,7 +246,7 @@ class SlidingSolver:
         moves = []
         pos = end
         while pos in paths:
-            moves.append(pos)
+            moves.append((pos % size, pos // size))
             pos = paths[pos]
         return moves[::-1]
 
@@ -180,12 +254,16 @@ class SlidingSolver:
         """Moves the item at the `start` postition to the `end` postition
         by swapping adjacent squares. One of the adjacent squares being
         swapped should always be a 0 (empty square)."""
+        self.move_zero(self.find_path(start, end))
+
+    def move_zero(self, positions):
+        """Moves the 0 square through each of `positions` in turn,
+        which should each be adjacent to the one before."""
         grid = self.grid
         current_moves = self.moves
         location_of = self.location_of
 
-        moves = self.find_path(start, end)  # `moves` are actually postitions
-        for mx, my in moves:
+        for mx, my in positions:
             ex, ey = location_of[0]
             num = grid[my][mx]
 
@@ -210,29 +288,87 @@ class SlidingSolver:
         `keep_fixed` are numbers that should be kept fixed during the moving sequences,
         but shouldn't remain in `self.fixed`. `fixed_in` and `fixed_out` are numbers
         that are fixed only when the 0 square is moving towards the target postition,
-        or towards the target number repectively."""
+        or towards the target number repectively.
+        Unless there are `fixed_in` or `fixed_out` numbers, `num` is first moved with
+        `slide_num`, which is much quicker, so the loop only finishes off anything
+        that is left."""
         grid = self.grid
         make_moves = self.make_moves
-        fixed = self.fixed
+        fix = self.fix
+        unfix = self.unfix
         location_of = self.location_of
 
-        fixed |= keep_fixed
+        fix(*keep_fixed)
+        if not fixed_in and not fixed_out:
+            self.slide_num(num, position)
         pos_x, pos_y = position
         while grid[pos_y][pos_x] != num:
 
             # 0 in moving back into the target position
-            fixed |= fixed_in
-            fixed -= fixed_out
-            fixed.add(num)
+            fix(*fixed_in)
+            unfix(*fixed_out)
+            fix(num)
             make_moves(location_of[0], position)
 
             # 0 in moving out to the target number
-            fixed |= fixed_out
-            fixed -= fixed_in
-            fixed.remove(num)
+            fix(*fixed_out)
+            unfix(*fixed_in)
+            unfix(num)
             make_moves(position, location_of[num])
-        fixed -= fixed_out
-        fixed -= keep_fixed
+        unfix(*fixed_out)
+        unfix(*keep_fixed)
+
+    def slide_num(self, num, position):
+        """Moves `num` towards `position` one square at a time along the shortest path.
+        Before each step the 0 square is cycled around `num` into the next square of
+        the path with a macro from `MACROS`, or with A* if none of the macros can be
+        used there, so the moves taken grow linearly with the distance.
+        Stops early if the 0 square can't get to the next square."""
+        size = self.size
+        passable = self.passable
+        location_of = self.location_of
+
+        try:
+            path = self.find_path(location_of[num], position)
+        except Exception:
+            return
+
+        for next_x, next_y in path:
+            x, y = location_of[num]
+            zero_x, zero_y = location_of[0]
+            key = (zero_x - x, zero_y - y), (next_x - x, next_y - y)
+            for macro in MACROS.get(key, ()):
+                positions = [(x + dx, y + dy) for dx, dy in macro]
+                if all(
+                    0 <= px < size and 0 <= py < size and passable[py * size + px]
+                    for px, py in positions
+                ):
+                    self.move_zero(positions)
+                    break
+            else:
+                self.fix(num)
+                try:
+                    self.make_moves(location_of[0], (next_x, next_y))
+                except Exception:
+                    return
+                finally:
+                    self.unfix(num)
+
+            self.move_zero([(x, y)])
+
+    def fix(self, *nums):
+        """Adds `nums` to `self.fixed`, so they can't be moved through"""
+        for num in nums:
+            self.fixed.add(num)
+            x, y = self.location_of[num]
+            self.passable[y * self.size + x] = False
+
+    def unfix(self, *nums):
+        """Removes `nums` from `self.fixed`"""
+        for num in nums:
+            self.fixed.discard(num)
+            x, y = self.location_of[num]
+            self.passable[y * self.size + x] = True
 
     def print_grid(self):
         """Prints the grid with each row on a new line."""